@@ -1,14 +1,161 @@
-import json
-import aiohttp
+import orjson
+import httpx
 import asyncio
 import pathlib
 import os
 import sys
 import itertools
+import diskcache
+from adaptio import with_adaptive_retry, ServiceOverloadError
 from utils import get_working_proxies
 
+# Connection pool limits for each per-proxy client. Every request goes to the
+# same OpenAlex host, so this is effectively a per-host cap; idle connections
+# are kept for five minutes so they survive the gaps between batches.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=50, keepalive_expiry=300)
+HTTP_TIMEOUT = httpx.Timeout(30, connect=10)
 
-async def get_paper_metadata(session, doi=None, url=None, proxy=None):
+# Contact address for the OpenAlex polite pool; set this to a real mailbox
+MAILTO = "you@example.com"
+
+# Only the work fields format_metadata reads
+OPENALEX_SELECT = "display_name,authorships,publication_year,doi,primary_location,biblio"
+
+# OpenAlex accepts at most 100 values in a single OR filter
+OPENALEX_BATCH_SIZE = 100
+
+# Status codes OpenAlex uses to signal that we should slow down
+OVERLOAD_STATUSES = {429, 503}
+
+# Failures of the proxy connection itself, as opposed to errors from OpenAlex
+PROXY_ERRORS = (httpx.ProxyError, httpx.ConnectError, httpx.ConnectTimeout)
+
+# Formatted records keyed by lowercase DOI, kept across runs; None marks a DOI OpenAlex returned 404 for
+metadata_cache = diskcache.Cache('./metadata_cache/openalex')
+CACHE_TTL = 30 * 86400
+NEGATIVE_CACHE_TTL = 86400
+_MISSING = object()
+
+# Caps the number of OpenAlex requests in flight at once
+REQUEST_SEMAPHORE = asyncio.Semaphore(50)
+
+# Upper bound on proxies working the fallback queue at once, and how many
+# failed batches a proxy may have before it is dropped from the run
+MAX_PROXY_WORKERS = 16
+MAX_PROXY_ERRORS = 3
+
+# One keep-alive client per proxy, so each proxy keeps its own TCP/TLS pool
+_clients = {}
+
+
+class JsonArrayWriter:
+    """Write records to a JSON array file one at a time instead of holding them all in memory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'wb')
+        self._file.write(b'[')
+        return self
+
+    def write(self, record):
+        self._file.write((b',\n' if self.count else b'\n') + orjson.dumps(record))
+        self.count += 1
+
+    def __exit__(self, *exc_info):
+        self._file.write(b'\n]\n')
+        self._file.close()
+
+
+def get_client(proxy=None):
+    """Return the cached HTTP/2 client for a proxy, creating it on first use."""
+    client = _clients.get(proxy)
+    if client is None:
+        client = httpx.AsyncClient(
+            proxy=f"http://{proxy}" if proxy else None,
+            http2=True,
+            timeout=HTTP_TIMEOUT,
+            limits=HTTP_LIMITS,
+        )
+        _clients[proxy] = client
+    return client
+
+
+async def close_clients():
+    """Close every cached client and release its connections."""
+    clients = list(_clients.values())
+    _clients.clear()
+    await asyncio.gather(*(client.aclose() for client in clients))
+
+
+def format_metadata(metadata):
+    """Flatten an OpenAlex work record into the fields we store."""
+    doi = metadata.get("doi", None)
+    if doi:
+        doi = doi[len("https://doi.org/"):]
+
+    authorships = metadata.get("authorships") or []
+    biblio = metadata.get("biblio") or {}
+    # OpenAlex dropped host_venue; the venue now lives on the primary location's source
+    source = (metadata.get("primary_location") or {}).get("source") or {}
+
+    return {
+        "title": metadata.get("display_name", "No Title Available"),
+        "first_author": authorships[0]["author"]["display_name"] if authorships else "No Author",
+        "authors": ", ".join(a["author"]["display_name"] for a in authorships),
+        "year": metadata.get("publication_year", "Unknown Year"),
+        "doi": doi,
+        "doi_url": metadata.get("doi", "No DOI available"),
+        "journal_or_institution": source.get("display_name") or "Unknown Institution",
+        "pages": f"{biblio.get('first_page', '')}-{biblio.get('last_page', '')}",
+        "volume": biblio.get("volume", ""),
+        "number": biblio.get("issue", "")
+    }
+
+
+@with_adaptive_retry(
+    max_concurrency=128,
+    min_concurrency=4,
+    initial_concurrency=16,
+    adjust_overload_rate=0.1,
+    overload_exception=ServiceOverloadError,
+)
+async def fetch_openalex_batch(client, dois):
+    """Fetch up to OPENALEX_BATCH_SIZE works in one request, keyed by lowercase DOI."""
+    # httpx encodes the params, so '#', '&', '+' or ';' inside a DOI can't break the query string
+    params = {
+        "filter": "doi:" + "|".join(dois),
+        "per-page": len(dois),
+        "select": OPENALEX_SELECT,
+        "mailto": MAILTO,
+    }
+    response = await client.get("https://api.openalex.org/works", params=params)
+    if response.status_code in OVERLOAD_STATUSES or 'Retry-After' in response.headers:
+        raise ServiceOverloadError(f"OpenAlex overloaded for a batch of {len(dois)} DOIs (status code {response.status_code}).")
+    if response.status_code != 200:
+        print(f"Error: Received status code {response.status_code} for a batch of {len(dois)} DOIs.")
+        return {}
+
+    results = {}
+    for metadata in orjson.loads(response.content).get("results", []):
+        paper_data = format_metadata(metadata)
+        if paper_data["doi"]:
+            results[paper_data["doi"].lower()] = paper_data
+            metadata_cache.set(paper_data["doi"].lower(), paper_data, expire=CACHE_TTL)
+    return results
+
+
+@with_adaptive_retry(
+    max_concurrency=128,
+    min_concurrency=4,
+    initial_concurrency=16,
+    adjust_overload_rate=0.1,
+    overload_exception=ServiceOverloadError,
+)
+async def get_paper_metadata(client, doi=None, url=None):
     """Fetch metadata of a paper from OpenAlex API using DOI or URL asynchronously."""
     if not any([doi, url]):
         raise ValueError("At least one of 'doi' or 'url' must be provided.")
@@ -16,34 +163,34 @@ async def get_paper_metadata(session, doi=None, url=None, proxy=None):
     # Build the API URL
     if doi:
         doi = doi.replace("https://doi.org/", "")
-        api_url = f"https://api.openalex.org/works/doi:{doi}"
+        paper_data = metadata_cache.get(doi.lower(), _MISSING)
+        if paper_data is not _MISSING:
+            if paper_data is None:
+                return {"title": "Error", "error": f"No OpenAlex record for {doi} (cached)."}
+            return dict(paper_data)
+        api_url = f"https://api.openalex.org/works/doi:{doi}?select={OPENALEX_SELECT}&mailto={MAILTO}"
     elif url:
-        api_url = f"https://api.openalex.org/works/{url}"
+        api_url = f"https://api.openalex.org/works/{url}?select={OPENALEX_SELECT}&mailto={MAILTO}"
 
     try:
-        # Pass the proxy URL directly to the get request
-        async with session.get(api_url, proxy=f"http://{proxy}" if proxy else None) as response:
-            if response.status != 200:
-                raise Exception(f"Error: Received status code {response.status} for {doi or url}.")
-            metadata = await response.json()
+        # The client is already bound to its proxy and keeps the connection alive
+        response = await client.get(api_url)
+        if response.status_code in OVERLOAD_STATUSES or 'Retry-After' in response.headers:
+            raise ServiceOverloadError(f"OpenAlex overloaded for {doi or url} (status code {response.status_code}).")
+        if response.status_code == 404 and doi:
+            metadata_cache.set(doi.lower(), None, expire=NEGATIVE_CACHE_TTL)
+        if response.status_code != 200:
+            raise Exception(f"Error: Received status code {response.status_code} for {doi or url}.")
+        metadata = orjson.loads(response.content)
 
-        doi = metadata.get("doi", None)
+        paper_data = format_metadata(metadata)
         if doi:
-            doi = doi[len("https://doi.org/"):]
-        title = metadata.get("display_name", "No Title Available")
-
-        return {
-            "title": metadata.get("display_name", "No Title Available"),
-            "first_author": metadata["authorships"][0]["author"]["display_name"] if metadata.get("authorships") else "No Author",
-            "authors": ", ".join([author["author"]["display_name"] for author in metadata.get("authorships", [])]),
-            "year": metadata.get("publication_year", "Unknown Year"),
-            "doi": doi,
-            "doi_url": metadata.get("doi", "No DOI available"),
-            "journal_or_institution": metadata.get("host_venue", {}).get("display_name", "Unknown Institution"),
-            "pages": f"{metadata['biblio'].get('first_page', '')}-{metadata['biblio'].get('last_page', '')}",
-            "volume": metadata["biblio"].get("volume", ""),
-            "number": metadata["biblio"].get("issue", "")
-        }
+            metadata_cache.set(doi.lower(), paper_data, expire=CACHE_TTL)
+        return paper_data
+    except ServiceOverloadError:
+        raise  # Let the adaptive limiter back off and retry
+    except PROXY_ERRORS:
+        raise  # The proxy failed, not the lookup; let the caller move the paperlink elsewhere
     except Exception as e:
         print(f"Error fetching metadata: {e}")
         return {
@@ -52,65 +199,181 @@ async def get_paper_metadata(session, doi=None, url=None, proxy=None):
         }
 
 
-async def process_article_batch(session, article_batch, proxy, proxy_limit=50):
-    """Process a batch of articles and fetch metadata for each paperlink."""
+async def _guarded(coro):
+    """Run a request coroutine while holding a slot of the request semaphore."""
+    async with REQUEST_SEMAPHORE:
+        return await coro
+
+
+async def process_article_batch(client, article_batch, proxy_limit=50):
+    """Process a batch of articles and fetch metadata for each paperlink concurrently.
+
+    Returns the processed papers, the success count, and the unfinished part of
+    the batch: paperlinks past proxy_limit plus any the proxy itself failed on.
+    """
+    pairs = [(article, paperlink) for article in article_batch for paperlink in article['paperlinks']]
+    # Only schedule up to proxy_limit paperlinks for this proxy
+    scheduled, tail = pairs[:proxy_limit], pairs[proxy_limit:]
+    tasks = [
+        asyncio.ensure_future(_guarded(get_paper_metadata(client, doi=paperlink.get('doi'), url=paperlink.get('paperlink'))))
+        for _, paperlink in scheduled
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
     processed_papers = []
+    unfinished = list(tail)
     success_count = 0  # Count the number of successful scrapes
+    for (article, paperlink), paper_data in zip(scheduled, results):
+        if isinstance(paper_data, Exception):
+            print(f"Error processing {paperlink['paperlink']}: {paper_data}")
+            if isinstance(paper_data, PROXY_ERRORS):
+                unfinished.append((article, paperlink))  # Not this paper's fault; retry it elsewhere
+            continue
+
+        paper_data['source_article_title'] = article['title']
+        processed_papers.append(paper_data)
+        success_count += 1  # Increment success count
+
+        # Print successful request details
+        print(f"Success: {paper_data['title']} (DOI: {paper_data.get('doi', 'N/A')}, URL: {paperlink.get('paperlink')})")
+
+    # Regroup the unfinished paperlinks under their articles
+    unfinished_batch = {}
+    for article, paperlink in unfinished:
+        unfinished_batch.setdefault(id(article), dict(article, paperlinks=[]))['paperlinks'].append(paperlink)
+
+    return processed_papers, success_count, list(unfinished_batch.values())
 
-    for article in article_batch:
-        for paperlink in article['paperlinks']:
-            if success_count >= proxy_limit:
-                # Stop the batch when the limit is reached
-                return processed_papers, success_count
 
-            try:
-                paper_data = await get_paper_metadata(session, doi=paperlink.get('doi'), url=paperlink.get('paperlink'), proxy=proxy)
-                paper_data['source_article_title'] = article['title']
-                processed_papers.append(paper_data)
-                success_count += 1  # Increment success count
+def chunk_articles(articles, size):
+    """Split articles into batches holding at most `size` paperlinks in total."""
+    batch, count = [], 0
+    for article in articles:
+        paperlinks = article['paperlinks']
+        for start in range(0, len(paperlinks), size):
+            part = paperlinks[start:start + size]
+            if batch and count + len(part) > size:
+                yield batch
+                batch, count = [], 0
+            batch.append(dict(article, paperlinks=part))
+            count += len(part)
+    if batch:
+        yield batch
 
-                # Print successful request details
-                print(f"Success: {paper_data['title']} (DOI: {paper_data.get('doi', 'N/A')}, URL: {paperlink.get('paperlink')})")
-            except Exception as e:
-                print(f"Error processing {paperlink['paperlink']}: {e}")
-                return processed_papers, success_count  # Return on error to switch proxy
 
-    return processed_papers, success_count
+async def proxy_worker(proxy, queue, writer, proxy_limit=50):
+    """Process article batches from the queue through one proxy until it runs out of error budget."""
+    client = get_client(proxy)
+    errors = 0
+    while errors < MAX_PROXY_ERRORS:
+        article_batch = await queue.get()
+        try:
+            processed_papers, success_count, unfinished = await process_article_batch(client, article_batch, proxy_limit=proxy_limit)
+            for paper_data in processed_papers:
+                writer.write(paper_data)
+            if unfinished:
+                queue.put_nowait(unfinished)  # Only the paperlinks that still need fetching
+            if not success_count:
+                errors += 1
+        except Exception as e:
+            print(f"Error with proxy {proxy}: {e}")
+            errors += 1
+            queue.put_nowait(article_batch)  # Hand the batch to another proxy
+        finally:
+            queue.task_done()
+    print(f"Dropping proxy {proxy} after {errors} failed batches")
+
+
+async def fetch_all_dois(articles, proxies):
+    """Look up every paperlink DOI in batches and return the metadata keyed by lowercase DOI."""
+    dois = {
+        paperlink['doi'].replace("https://doi.org/", "").lower()
+        for article in articles
+        for paperlink in article['paperlinks']
+        if paperlink.get('doi')
+    }
+
+    # Serve what we already have from the disk cache and only fetch the rest
+    metadata_by_doi = {}
+    for doi in list(dois):
+        paper_data = metadata_cache.get(doi, _MISSING)
+        if paper_data is not _MISSING:
+            dois.discard(doi)
+            if paper_data is not None:
+                metadata_by_doi[doi] = paper_data
+
+    # '|' and ',' would split a DOI inside the OR filter; those are left to the per-paperlink lookups
+    dois = {doi for doi in dois if '|' not in doi and ',' not in doi}
+
+    # Chunk the DOIs and scatter the chunks across the proxies
+    doi_iter = iter(sorted(dois))
+    chunks = list(iter(lambda: list(itertools.islice(doi_iter, OPENALEX_BATCH_SIZE)), []))
+    print(f"Fetching {len(dois)} DOIs in {len(chunks)} batches")
+    tasks = [
+        _guarded(fetch_openalex_batch(get_client(proxies[index % len(proxies)]), chunk))
+        for index, chunk in enumerate(chunks)
+    ]
+
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            print(f"Error fetching DOI batch: {result}")
+            continue
+        metadata_by_doi.update(result)
+    return metadata_by_doi
 
 
 async def process_all_articles(articleinfos_path, output_path, proxies, proxy_limit=50):
     """Open articleinfos.json, process each article with 50 per proxy, and save results to a new JSON file."""
-    with open(articleinfos_path, 'r') as f:
-        articles = json.load(f)
-
-    all_processed_papers = []
-
-    # Use itertools.cycle to cycle through proxies
-    proxy_cycle = itertools.cycle(proxies)
-
-    # Batch articles
-    batch_size = 50  # Process 50 articles per proxy
-    async with aiohttp.ClientSession() as session:
-        i = 0
-        while i < len(articles):
-            proxy = next(proxy_cycle)  # Use the next proxy in the cycle
-            article_batch = articles[i:i + batch_size]
-            print(f"Processing batch {i + 1} to {i + batch_size} using proxy: {proxy}")
-
-            # Process the batch
-            try:
-                processed_papers, success_count = await process_article_batch(session, article_batch, proxy, proxy_limit=proxy_limit)
-                all_processed_papers.extend(processed_papers)
-                i += success_count  # Only move forward by the successful count
-            except Exception as e:
-                print(f"Error with proxy {proxy}: {e}")
-                proxy = next(proxy_cycle)  # Switch proxy if there's an error
-
-    # Save the final processed papers to the output file
-    with open(output_path, 'w') as f:
-        json.dump(all_processed_papers, f, indent=4)
-
-    print(f"Paper metadata saved to {output_path}")
+    with open(articleinfos_path, 'rb') as f:
+        articles = orjson.loads(f.read())
+
+    if not proxies:
+        print("No working proxies; connecting to OpenAlex directly")
+        proxies = [None]
+
+    with JsonArrayWriter(output_path) as writer:
+        try:
+            # Resolve DOIs in bulk first, then join the results back to their articles
+            metadata_by_doi = await fetch_all_dois(articles, proxies)
+
+            remaining_articles = []
+            for article in articles:
+                leftover = []
+                for paperlink in article['paperlinks']:
+                    doi = paperlink.get('doi')
+                    paper_data = metadata_by_doi.get(doi.replace("https://doi.org/", "").lower()) if doi else None
+                    if paper_data:
+                        writer.write(dict(paper_data, source_article_title=article['title']))
+                    else:
+                        leftover.append(paperlink)
+                if leftover:
+                    remaining_articles.append(dict(article, paperlinks=leftover))
+
+            # Fall back to one request per paperlink for URLs and DOIs the batch lookup missed
+            queue = asyncio.Queue()
+            for article_batch in chunk_articles(remaining_articles, proxy_limit):
+                queue.put_nowait(article_batch)
+            print(f"Processing {queue.qsize()} leftover batches")
+
+            # One worker per proxy, all pulling from the same queue
+            workers = [
+                asyncio.create_task(proxy_worker(proxy, queue, writer, proxy_limit))
+                for proxy in proxies[:MAX_PROXY_WORKERS]
+            ]
+            queue_done = asyncio.create_task(queue.join())
+            workers_done = asyncio.gather(*workers)
+            await asyncio.wait([queue_done, workers_done], return_when=asyncio.FIRST_COMPLETED)
+            if not queue_done.done():
+                print(f"Every proxy was dropped; {queue.qsize()} batches left unprocessed")
+            queue_done.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            await close_clients()
+            metadata_cache.close()
+
+    print(f"{writer.count} papers' metadata saved to {output_path}")
 
 
 # Main function
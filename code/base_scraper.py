@@ -17,6 +17,11 @@ class BaseScraper(ABC):
         """Load data from a JSON file."""
         pass
 
+    @abstractmethod
+    async def load_existing_output(self):
+        """Load previously saved output so finished work can be skipped."""
+        pass
+
     @abstractmethod
     async def save_to_json(self, output_data):
         """Save data to a JSON file."""
@@ -1,10 +1,13 @@
-import json
+import orjson
 import logging
 import sys
-import aiohttp
+import httpx
 import aiofiles
 import asyncio
-from random import choice
+import diskcache
+from random import choices
+from adaptio import with_adaptive_retry, ServiceOverloadError
+import crossref_parse
 from utils import get_working_proxies
 
 # Set up logging
@@ -18,16 +21,81 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)  # Set up logger
 
+# Contact address for the Crossref polite pool; set this to a real mailbox
+MAILTO = "you@example.com"
 
-class BaseScraper:
+# Status codes Crossref uses to signal that we should slow down
+OVERLOAD_STATUSES = {429, 503}
+
+# How long fetched records, and DOIs Crossref does not know, stay cached on disk
+CACHE_TTL = 30 * 86400
+NEGATIVE_CACHE_TTL = 86400
+_MISSING = object()
+
+# Only the record fields get_json reads
+CROSSREF_SELECT = "DOI,title,author,issued,container-title,short-container-title,volume,issue,page,article-number"
+
+# A proxy is evicted once it has this many attempts and a success rate below the threshold
+PROXY_EVICT_MIN_ATTEMPTS = 10
+PROXY_EVICT_SUCCESS_RATE = 0.1
+
+# Output is flushed to disk in chunks of about this many bytes
+WRITE_CHUNK_SIZE = 1 << 20
+
+
+class ProxyScraper:
     def __init__(self, proxies, fix_uppercase=False, max_retries=3):
         self.proxies = proxies
         self.fix_uppercase = fix_uppercase
         self.max_retries = max_retries
+        self.limits = httpx.Limits(max_keepalive_connections=50, max_connections=200)
+        self.clients = {}  # One keep-alive HTTP/2 client per proxy
+        self.proxy_stats = {proxy: [0, 0] for proxy in proxies}  # [successes, attempts]
+
+    def get_client(self, proxy):
+        """Return the cached client for a proxy, creating it on first use."""
+        client = self.clients.get(proxy)
+        if client is None:
+            client = httpx.AsyncClient(
+                proxy=f"http://{proxy}" if proxy else None,
+                http2=True,
+                timeout=30,
+                limits=self.limits,
+            )
+            self.clients[proxy] = client
+        return client
+
+    def pick_proxy(self):
+        """Pick a proxy at random, weighted by its smoothed success rate."""
+        proxies = list(self.proxy_stats)
+        weights = [(success + 1) / (total + 2) for success, total in self.proxy_stats.values()]
+        return choices(proxies, weights=weights, k=1)[0]
+
+    def record_attempt(self, proxy, ok):
+        """Update a proxy's scoreboard and evict it if it keeps failing."""
+        stats = self.proxy_stats.get(proxy)
+        if stats is None:
+            return  # Already evicted by a concurrent request
+        stats[1] += 1
+        if ok:
+            stats[0] += 1
+        elif (stats[1] >= PROXY_EVICT_MIN_ATTEMPTS and stats[0] / stats[1] < PROXY_EVICT_SUCCESS_RATE
+              and len(self.proxy_stats) > 1):
+            del self.proxy_stats[proxy]
+            logger.warning(f"Evicting proxy {proxy} after {stats[0]}/{stats[1]} successful attempts")
+
+    async def close(self):
+        """Close all cached clients."""
+        clients = list(self.clients.values())
+        self.clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients))
 
     async def run_with_proxy_async(self, func, *args, retries=3, **kwargs):
         """
-        Runs an async function with a random proxy. Retries the function with a new proxy if it fails.
+        Runs an async function with a proxy picked by recent success rate. Retries the function with a new proxy if it fails.
+
+        Server overload (ServiceOverloadError) is not retried here; it is raised
+        straight away so the adaptive limiter can back off and retry instead.
 
         Parameters:
         - func: The async function to run.
@@ -36,126 +104,119 @@ class BaseScraper:
         - kwargs: Keyword arguments to pass to the function.
         """
         for attempt in range(retries):
-            proxy = choice(self.proxies)
+            proxy = self.pick_proxy()
             try:
-                # Use the proxy for the request if it's not None
-                if proxy:
-                    proxy_dict = {
-                        "http": f"http://{proxy}",
-                        "https": f"http://{proxy}"
-                    }
-                    kwargs['proxy'] = proxy_dict
-                else:
-                    kwargs['proxy'] = None
+                # Hand the function the keep-alive client bound to this proxy
+                kwargs['client'] = self.get_client(proxy)
 
                 # Execute the async function with the current proxy
                 result = await func(*args, **kwargs)
+                self.record_attempt(proxy, True)
                 return result
 
+            except ServiceOverloadError:
+                raise
             except Exception as e:
+                self.record_attempt(proxy, False)
                 logger.error(f"Attempt {attempt + 1} failed with proxy {proxy}. Retrying...")
                 continue
 
         raise Exception("All proxy attempts failed.")
 
 
-class MetadataScraper(BaseScraper):
+class MetadataScraper(ProxyScraper):
     def __init__(self, proxies, fix_uppercase=False, max_retries=3):
         super().__init__(proxies, fix_uppercase, max_retries)
+        # Identify ourselves so Crossref routes us to the polite pool, and accept compressed bodies
+        self.headers = {
+            "User-Agent": f"science_news/1.0 (mailto:{MAILTO})",
+            "Accept-Encoding": "gzip, deflate",
+        }
+        # Parsed records keyed by DOI, kept across runs; None marks a DOI Crossref returned 404 for
+        self.cache = diskcache.Cache('./metadata_cache/crossref')
+
+    async def close(self):
+        """Close all cached clients and the on-disk cache."""
+        await super().close()
+        self.cache.close()
 
     def get_names(self, crossref_record, field):
         """Extract (author/editor) names from the Crossref record."""
-        try:
-            name_records = crossref_record[field]
-        except KeyError:
-            return None
-        if self.fix_uppercase:
-            return [
-                f"{a['family'].title()}, {a['given'].title()}"
-                for a in name_records
-            ]
-        else:
-            return [
-                f"{a['family']}, {a['given']}" for a in name_records
-            ]
+        return crossref_parse.get_names(crossref_record, field, self.fix_uppercase)
 
     def get_journal(self, crossref_record):
         """Extract journal from the Crossref record."""
-        keys = ['short-container-title', 'container-title']
-        name_candidates = [
-            name for key in keys for name in crossref_record.get(key, [])
-        ]
-        for journal_name in name_candidates:
-            if journal_name is not None:
-                return journal_name
-        return None
+        return crossref_parse.get_journal(crossref_record)
 
     def get_page(self, crossref_record):
         """Get page or article number from Crossref record."""
-        try:
-            page = crossref_record['article-number']
-        except KeyError:
-            page = crossref_record.get('page', None)
-        return page
+        return crossref_parse.get_page(crossref_record)
 
     def get_json(self, crossref_record):
         """Generate a JSON structure for the given Crossref record."""
-        try:
-            first_author = crossref_record['author'][0]['family'].capitalize()
-        except (KeyError, IndexError):
-            first_author = None
-
-        author = self.get_names(crossref_record, 'author')
-        title = crossref_record.get('title', [None])[0]
-        try:
-            year = crossref_record['issued']['date-parts'][0][0]
-        except (KeyError, IndexError):
-            year = None
-
-        doi = crossref_record.get('DOI', None)
-        journal = self.get_journal(crossref_record)
-        pages = self.get_page(crossref_record)
-        volume = crossref_record.get('volume', None)
-        number = crossref_record.get('issue', None)
-
-        return {
-            "title": title,
-            "first_author": first_author,
-            "authors": author,
-            "year": year,
-            "doi": doi,
-            "journal": journal,
-            "pages": pages,
-            "volume": volume,
-            "number": number
-        }
-
-    async def fetch_metadata(self, doi, session):
-        """Fetch metadata for a single DOI asynchronously."""
-        url = f"https://api.crossref.org/works/{doi}"
+        return crossref_parse.get_json(crossref_record, self.fix_uppercase)
+
+    @with_adaptive_retry(
+        max_concurrency=128,
+        min_concurrency=4,
+        initial_concurrency=16,
+        adjust_overload_rate=0.1,
+        overload_exception=ServiceOverloadError,
+    )
+    async def fetch_metadata(self, doi):
+        """Fetch metadata for a single DOI, adapting concurrency to Crossref's load."""
+        cached = self.cache.get(doi, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        url = f"https://api.crossref.org/works/{doi}?select={CROSSREF_SELECT}"
         logger.info(f"Fetching metadata for DOI: {doi}")
 
-        async def fetch_doi(url, session):
-            async with session.get(url) as response:
-                if response.status != 200:
-                    logger.error(f"Failed to fetch data for DOI: {doi} (HTTP Status: {response.status})")
-                    return None
+        async def fetch_doi(url, client):
+            response = await client.get(url, headers=self.headers)
+            if response.status_code in OVERLOAD_STATUSES or 'Retry-After' in response.headers:
+                raise ServiceOverloadError(f"Crossref overloaded for DOI: {doi} (HTTP Status: {response.status_code})")
+            if response.status_code != 200:
+                logger.error(f"Failed to fetch data for DOI: {doi} (HTTP Status: {response.status_code})")
+                if response.status_code == 404:
+                    self.cache.set(doi, None, expire=NEGATIVE_CACHE_TTL)
+                return None
 
-                res = await response.json()
-                crossref_record = res['message']
-                return self.get_json(crossref_record)
+            res = orjson.loads(response.content)
+            crossref_record = res['message']
+            metadata = self.get_json(crossref_record)
+            self.cache.set(doi, metadata, expire=CACHE_TTL)
+            return metadata
 
-        return await self.run_with_proxy_async(fetch_doi, url, session)
+        return await self.run_with_proxy_async(fetch_doi, url)
 
 
 class FileHandler:
     @staticmethod
     async def save_to_json(data, filename="output.json"):
         """Save the JSON data to a file asynchronously."""
-        async with aiofiles.open(filename, 'w') as json_file:
-            await json_file.write(json.dumps(data, indent=4))
+        async with aiofiles.open(filename, 'wb') as json_file:
+            await json_file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
         logger.info(f"Data saved to {filename}")
 
+    @staticmethod
+    async def stream_to_json(records, filename="output.json"):
+        """Write records from an async iterator to a JSON array file as they arrive."""
+        count = 0
+        buffer = bytearray(b'[')
+        async with aiofiles.open(filename, 'wb') as json_file:
+            async for record in records:
+                buffer += (b',\n' if count else b'\n') + orjson.dumps(record)
+                count += 1
+                # Hand the thread pool one large write instead of one per record
+                if len(buffer) >= WRITE_CHUNK_SIZE:
+                    await json_file.write(bytes(buffer))
+                    buffer.clear()
+            buffer += b'\n]\n'
+            await json_file.write(bytes(buffer))
+        logger.info(f"{count} records saved to {filename}")
+        return count
+
 
 async def main(proxies):
     # Create the scraper instance here
@@ -163,9 +224,9 @@ async def main(proxies):
 
     # Read the urldictclean.json file asynchronously using aiofiles
     try:
-        async with aiofiles.open("urldictclean.json", "r") as json_file:
+        async with aiofiles.open("urldictclean.json", "rb") as json_file:
             content = await json_file.read()
-            articles = json.loads(content)
+            articles = orjson.loads(content)
     except FileNotFoundError:
         logger.error("The file urldictclean.json was not found.")
         sys.exit(1)
@@ -189,17 +250,30 @@ async def main(proxies):
     # Show the total number of DOIs
     logger.info(f"Total number of DOIs: {len(all_dois)}")
 
-    # Fetch metadata
-    async with aiohttp.ClientSession() as session:
-        all_metadata = await asyncio.gather(
-            *[scraper.fetch_metadata(doi, session) for doi in all_dois]
-        )
+    # Bound the number of concurrent Crossref requests
+    semaphore = asyncio.Semaphore(50)
 
-    # Remove None values (if any DOIs failed)
-    all_metadata = [metadata for metadata in all_metadata if metadata]
+    async def bounded_fetch(doi):
+        async with semaphore:
+            return await scraper.fetch_metadata(doi)
 
-    # Save all metadata to a single JSON file asynchronously
-    await FileHandler.save_to_json(all_metadata, filename="all_metadata.json")
+    async def completed_metadata():
+        # Yield records in completion order so none of them wait on the slowest DOI
+        for coro in asyncio.as_completed([bounded_fetch(doi) for doi in all_dois]):
+            try:
+                metadata = await coro
+            except Exception as e:
+                logger.error(f"Failed to fetch metadata: {e}")
+                continue
+            # Skip None values (if any DOIs failed)
+            if metadata:
+                yield metadata
+
+    # Fetch metadata and stream it to a single JSON file
+    try:
+        await FileHandler.stream_to_json(completed_metadata(), filename="all_metadata.json")
+    finally:
+        await scraper.close()
 
     logger.info("Metadata retrieval completed and saved to 'all_metadata.json'.")
 
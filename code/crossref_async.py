@@ -1,181 +1,259 @@
 import pprint
 import sys
-import json
+import orjson
 import logging  # Import logging module
-import requests_cache
+import logging.handlers
+import atexit
+import queue
 from habanero import Crossref
 import aiohttp
 import aiofiles
 import asyncio
 import pathlib
 import time
+import random
+import contextlib
+import itertools
+from aiolimiter import AsyncLimiter
+from aiohttp_client_cache import CachedSession, SQLiteBackend
+import crossref_parse
 from utils import get_working_proxies
 
 
-# Set up requests-cache
-requests_cache.install_cache('crossref_cache', expire_after=86400)  # Cache expires after 1 day (86400 seconds)
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("crossref_scraper.log"),  # Log to file
-        logging.StreamHandler(sys.stdout)  # Also log to console
-    ]
-)
+# Crossref responses are cached in SQLite so reruns skip DOIs fetched in the last day
+CACHE_PATH = 'crossref_cache.sqlite'
+CACHE_EXPIRE_AFTER = 86400  # Cache expires after 1 day (86400 seconds)
+
+# DOIs looked up per filter query; keeps the URL well under server length limits
+CROSSREF_BATCH_SIZE = 50
+
+# Output is flushed to disk in chunks of about this many bytes
+WRITE_CHUNK_SIZE = 1 << 20
+
+# Progress is logged once per this many DOIs rather than for every DOI
+LOG_PROGRESS_EVERY = 1000
+
+# Set up logging. Records go through a queue to a listener thread, so the event
+# loop never blocks on the file or console writes.
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler("crossref_scraper.log"),  # Log to file
+    logging.StreamHandler(sys.stdout)  # Also log to console
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue = queue.SimpleQueue()
+logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(_log_queue)], format='%(message)s')
+log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)  # Set up logger
 
 
 class CrossrefScraper:
-    def __init__(self, fix_uppercase=False, max_retries=3):
+    def __init__(self, fix_uppercase=False, max_retries=3, concurrency=64):
         self.fix_uppercase = fix_uppercase
         self.max_retries = max_retries
+        self.sem = asyncio.Semaphore(concurrency)  # Caps the Crossref requests in flight
+        # Request rate, re-tuned from Crossref's X-Rate-Limit-* headers as responses arrive
+        self.rate_limit = (50, 1.0)
+        self.limiter = AsyncLimiter(*self.rate_limit)
+        # Response cache and one session per proxy, opened by __aenter__ and reused for the scraper's lifetime
+        self.cache = None
+        self.sessions = {}
+
+    async def __aenter__(self):
+        self.cache = SQLiteBackend(CACHE_PATH, expire_after=CACHE_EXPIRE_AFTER, allowed_codes=(200, 404))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        await asyncio.gather(*(session.close() for session in sessions))
+
+    def get_session(self, proxy=None):
+        """Return the session for a proxy, creating it on first use so it keeps its own keep-alive connections."""
+        session = self.sessions.get(proxy)
+        if session is None:
+            session = CachedSession(
+                cache=self.cache,
+                connector=aiohttp.TCPConnector(limit_per_host=32, ttl_dns_cache=600, keepalive_timeout=75),
+                proxy=f"http://{proxy}" if proxy else None,
+            )
+            self.sessions[proxy] = session
+        return session
+
+    def update_rate_limit(self, headers):
+        """Match the limiter to the rate Crossref advertises in its response headers."""
+        try:
+            limit = int(headers['X-Rate-Limit-Limit'])
+            interval = float(headers['X-Rate-Limit-Interval'].rstrip('s'))
+        except (KeyError, ValueError):
+            return
+        if (limit, interval) != self.rate_limit:
+            logger.info("Crossref rate limit is now %s requests per %ss", limit, interval)
+            self.rate_limit = (limit, interval)
+            self.limiter = AsyncLimiter(limit, interval)
 
     def get_names(self, crossref_record, field):
         """Extract (author/editor) names from the Crossref record."""
-        try:
-            name_records = crossref_record[field]
-        except KeyError:
-            return None
-        if self.fix_uppercase:
-            return [
-                f"{a['family'].title()}, {a['given'].title()}"
-                for a in name_records
-            ]
-        else:
-            return [
-                f"{a['family']}, {a['given']}" for a in name_records
-            ]
+        return crossref_parse.get_names(crossref_record, field, self.fix_uppercase)
 
     def get_journal(self, crossref_record):
         """Extract journal from the Crossref record."""
-        keys = ['short-container-title', 'container-title']
-        name_candidates = [
-            name for key in keys for name in crossref_record.get(key, [])
-        ]
-        for journal_name in name_candidates:
-            if journal_name is not None:
-                return journal_name
-        return None
+        return crossref_parse.get_journal(crossref_record)
 
     def get_page(self, crossref_record):
         """Get page or article number from Crossref record."""
-        try:
-            page = crossref_record['article-number']
-        except KeyError:
-            page = crossref_record.get('page', None)
-        return page
+        return crossref_parse.get_page(crossref_record)
 
     def get_json(self, crossref_record):
         """Generate a JSON structure for the given Crossref record."""
-        try:
-            first_author = crossref_record['author'][0]['family'].capitalize()
-        except (KeyError, IndexError):
-            first_author = None
+        return crossref_parse.get_json(crossref_record, self.fix_uppercase)
+
+    async def _get_json(self, url, session, label):
+        """GET a Crossref API URL with rate limiting and retries, returning the decoded body or None."""
+        async with self.sem:
+            for attempt in range(self.max_retries):
+                if attempt:
+                    # Exponential backoff with jitter before each retry
+                    await asyncio.sleep(2 ** attempt + random.random())
+                try:
+                    # Cache hits never reach Crossref, so they don't spend rate-limit tokens
+                    limiter = contextlib.nullcontext() if await session.cache.has_url(url) else self.limiter
+                    async with limiter:
+                        async with session.get(url) as response:
+                            self.update_rate_limit(response.headers)
+                            if response.status == 429 or response.status >= 500:
+                                logger.info("Retrying %s after HTTP %s, attempt %s of %s...", label, response.status, attempt + 1, self.max_retries)
+                                continue
+                            if response.status != 200:
+                                logger.error("Failed to fetch data for %s (HTTP Status: %s)", label, response.status)
+                                return None
+
+                            return orjson.loads(await response.read())
+
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc_info:
+                    logger.error("Error fetching metadata for %s: %s", label, exc_info)
+                    logger.info("Retrying %s, attempt %s of %s...", label, attempt + 1, self.max_retries)
+                except Exception as exc_info:
+                    logger.error("Error processing metadata for %s: %s", label, exc_info)
+                    return None
+
+        logger.error("Failed to fetch metadata for %s after %s attempts.", label, self.max_retries)
+        return None
 
-        author = self.get_names(crossref_record, 'author')
-        title = crossref_record.get('title', [None])[0]
-        try:
-            year = crossref_record['issued']['date-parts'][0][0]
-        except (KeyError, IndexError):
-            year = None
-
-        doi = crossref_record.get('DOI', None)
-        journal = self.get_journal(crossref_record)
-        pages = self.get_page(crossref_record)
-        volume = crossref_record.get('volume', None)
-        number = crossref_record.get('issue', None)
-
-        return {
-            "title": title,
-            "first_author": first_author,
-            "authors": author,
-            "year": year,
-            "doi": doi,
-            "journal": journal,
-            "pages": pages,
-            "volume": volume,
-            "number": number
-        }
-
-    async def get_json_from_doi(self, doi, session, proxy):
+    async def get_json_from_doi(self, doi, proxy=None):
         """Generate a JSON entry for the given DOI asynchronously with retries."""
         url = f"https://api.crossref.org/works/{doi}"
-        logger.info(f"Fetching metadata for DOI: {doi}")
-
-        proxy_str = None
-        if proxy:
-            proxy_str = f"http://{proxy}"
-
-        for attempt in range(self.max_retries):
-            try:
-                async with session.get(url, proxy=proxy_str) as response:
-                    if response.status != 200:
-                        logger.error(f"Failed to fetch data for DOI: {doi} (HTTP Status: {response.status})")
-                        continue
-
-                    res = await response.json()
-                    crossref_record = res['message']
-                    metadata = self.get_json(crossref_record)
-                    logger.info(f"Successfully fetched metadata for DOI: {doi}")
-                    return metadata
-
-            except Exception as exc_info:
-                logger.error(f"Error processing metadata for DOI {doi}: {exc_info}")
-                logger.info(f"Retrying {doi}, attempt {attempt + 1} of {self.max_retries}...")
-
-        logger.error(f"Failed to fetch metadata for DOI {doi} after {self.max_retries} attempts.")
-        return None
+        logger.debug("Fetching metadata for DOI: %s", doi)
 
-    async def fetch_all_metadata(self, dois, proxies):
-        """Fetch metadata for all DOIs asynchronously using proxy rotation."""
-        total_dois = len(dois)
-        logger.info(f"Total DOIs to process: {total_dois}")
+        res = await self._get_json(url, self.get_session(proxy), f"DOI: {doi}")
+        if res is None:
+            return None
+        try:
+            metadata = self.get_json(res['message'])
+        except Exception as exc_info:
+            logger.error("Error processing metadata for DOI %s: %s", doi, exc_info)
+            return None
+        logger.debug("Successfully fetched metadata for DOI: %s", doi)
+        return metadata
+
+    async def fetch_batch(self, dois, proxy=None):
+        """Fetch up to CROSSREF_BATCH_SIZE DOIs in one filter query, keyed by lowercase DOI; None if the query failed."""
+        url = "https://api.crossref.org/works?filter=" + ",".join(f"doi:{doi}" for doi in dois) + f"&rows={len(dois)}"
+        logger.debug("Fetching metadata for a batch of %s DOIs", len(dois))
 
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for index, doi in enumerate(dois):
-                # Switch proxy every 20 requests
-                if index % 20 == 0:
-                    proxy_index = (index // 20) % len(proxies)
-                    proxy = proxies[proxy_index]
-                    logger.info(f"Switching to proxy: {proxy}")
+        res = await self._get_json(url, self.get_session(proxy), f"a batch of {len(dois)} DOIs")
+        if res is None:
+            return None
+        try:
+            return {
+                item['DOI'].lower(): self.get_json(item)
+                for item in res['message']['items']
+                if item.get('DOI')
+            }
+        except Exception as exc_info:
+            logger.error("Error processing metadata for a batch of %s DOIs: %s", len(dois), exc_info)
+            return None
 
-                tasks.append(self.get_json_from_doi(doi, session, proxy))
-                # Print manual counting of processed DOIs
-                logger.info(f"Processed DOI {index + 1} of {total_dois}")
+    async def _fetch_batch_records(self, dois, proxy=None):
+        # Fall back to one request per DOI if the batch query itself failed
+        results = await self.fetch_batch(dois, proxy)
+        if results is not None:
+            return list(results.values())
+        return await asyncio.gather(*(self.get_json_from_doi(doi, proxy) for doi in dois))
 
-            return await asyncio.gather(*tasks)
+    async def fetch_all_metadata(self, dois, proxies):
+        """Fetch metadata for all DOIs using proxy rotation, yielding records as they complete."""
+        # Each DOI is only looked up once; commas would split a DOI inside a filter query
+        unique_dois = list(dict.fromkeys(dois))
+        batchable = iter([doi for doi in unique_dois if ',' not in doi])
+        batches = list(iter(lambda: list(itertools.islice(batchable, CROSSREF_BATCH_SIZE)), []))
+        singles = [[doi] for doi in unique_dois if ',' in doi]
+        logger.info("Total DOIs to process: %s in %s batches", len(unique_dois), len(batches))
+
+        tasks = []
+        processed = 0
+        try:
+            for index, batch in enumerate(batches + singles):
+                # Round-robin the batches across the proxies
+                proxy = proxies[index % len(proxies)]
+                tasks.append(asyncio.create_task(self._fetch_batch_records(batch, proxy)))
+
+            # Hand back each batch as soon as it is ready instead of waiting on the slowest one
+            for coro in asyncio.as_completed(tasks):
+                results = await coro
+                for metadata in results:
+                    # Skip None values (if any DOIs failed)
+                    if metadata:
+                        yield metadata
+                # Batches finish in any order, so report whenever a multiple of LOG_PROGRESS_EVERY is crossed
+                if (processed + len(results)) // LOG_PROGRESS_EVERY > processed // LOG_PROGRESS_EVERY:
+                    logger.info("Processed %s of %s DOIs", processed + len(results), len(unique_dois))
+                processed += len(results)
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def save_to_json(self, data, filename="output.json"):
         """Save the JSON data to a file asynchronously."""
-        async with aiofiles.open(filename, 'w') as json_file:
-            await json_file.write(json.dumps(data, indent=4))
-        logger.info(f"Data saved to {filename}")
+        async with aiofiles.open(filename, 'wb') as json_file:
+            await json_file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        logger.info("Data saved to %s", filename)
+
+    async def stream_to_json(self, records, filename="output.json"):
+        """Write records from an async iterator to a JSON array file as they arrive."""
+        count = 0
+        buffer = bytearray(b'[')
+        async with aiofiles.open(filename, 'wb') as json_file:
+            async for record in records:
+                buffer += (b',\n' if count else b'\n') + orjson.dumps(record)
+                count += 1
+                # Hand the thread pool one large write instead of one per record
+                if len(buffer) >= WRITE_CHUNK_SIZE:
+                    await json_file.write(bytes(buffer))
+                    buffer.clear()
+            buffer += b'\n]\n'
+            await json_file.write(bytes(buffer))
+        logger.info("%s records saved to %s", count, filename)
+        return count
 
 
 # New function to encapsulate main logic
-async def clean_and_fetch_metadata(doi_list, proxies):
-    """Main logic to clean URLs and fetch metadata."""
-    scraper = CrossrefScraper()
-
-    # Fetch metadata using proxy rotation
-    metadata = await scraper.fetch_all_metadata(doi_list, proxies)
-
-    # Return metadata for further processing (if needed)
-    return metadata
+async def clean_and_fetch_metadata(doi_list, proxies, filename="all_metadata.json"):
+    """Main logic to fetch metadata and stream it to a JSON file."""
+    async with CrossrefScraper() as scraper:
+        # Fetch metadata using proxy rotation, writing each record as it completes
+        return await scraper.stream_to_json(scraper.fetch_all_metadata(doi_list, proxies), filename=filename)
 
 
 async def main(proxies):
-    # Create the scraper instance here
-    scraper = CrossrefScraper()
-
     # Read the urldictclean.json file asynchronously using aiofiles
     try:
-        async with aiofiles.open("urldictclean.json", "r") as json_file:
+        async with aiofiles.open("urldictclean.json", "rb") as json_file:
             content = await json_file.read()
-            articles = json.loads(content)
+            articles = orjson.loads(content)
     except FileNotFoundError:
         logger.error("The file urldictclean.json was not found.")
         sys.exit(1)
@@ -197,16 +275,10 @@ async def main(proxies):
         sys.exit(1)
 
     # Show the total number of DOIs
-    logger.info(f"Total number of DOIs: {len(all_dois)}")
-
-    # Use the clean_and_fetch_metadata function to fetch metadata
-    all_metadata = await clean_and_fetch_metadata(all_dois, proxies)
-
-    # Remove None values (if any DOIs failed)
-    all_metadata = [metadata for metadata in all_metadata if metadata]
+    logger.info("Total number of DOIs: %s", len(all_dois))
 
-    # Save all metadata to a single JSON file asynchronously
-    await scraper.save_to_json(all_metadata, filename="all_metadata.json")
+    # Use the clean_and_fetch_metadata function to fetch and save metadata
+    await clean_and_fetch_metadata(all_dois, proxies, filename="all_metadata.json")
 
     logger.info("Metadata retrieval completed and saved to 'all_metadata.json'.")
 
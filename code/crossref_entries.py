@@ -1,49 +1,44 @@
-import pprint
+import logging
+import reprlib
 import sys
-import json
-from habanero import Crossref
+import orjson
+import requests
 import habanero
+import crossref_parse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Truncates large nested fields when a record is dumped for debugging
+_record_repr = reprlib.Repr()
+_record_repr.maxdict = 10
+_record_repr.maxlist = 10
 
 
 class CrossrefScraper:
-    def __init__(self, fix_uppercase=False):
-        self.cr = Crossref()  # Initialize the Crossref client
+    def __init__(self, fix_uppercase=False, max_workers=16):
         self.fix_uppercase = fix_uppercase
+        self.max_workers = max_workers
+        # One pooled session for every request, retrying rate limits and server errors with backoff
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+        ))
 
     def get_names(self, crossref_record, field):
         """Extract (author/editor) names from the Crossref record."""
-        try:
-            name_records = crossref_record[field]
-        except KeyError:
-            return None
-        if self.fix_uppercase:
-            return [
-                f"{a['family'].title()}, {a['given'].title()}"
-                for a in name_records
-            ]
-        else:
-            return [
-                f"{a['family']}, {a['given']}" for a in name_records
-            ]
+        return crossref_parse.get_names(crossref_record, field, self.fix_uppercase)
 
     def get_journal(self, crossref_record):
         """Extract journal from the Crossref record."""
-        keys = ['short-container-title', 'container-title']
-        name_candidates = [
-            name for key in keys for name in crossref_record.get(key, [])
-        ]
-        for journal_name in name_candidates:
-            if journal_name is not None:
-                return journal_name
-        return None
+        return crossref_parse.get_journal(crossref_record)
 
     def get_page(self, crossref_record):
         """Get page or article number from Crossref record."""
-        try:
-            page = crossref_record['article-number']
-        except KeyError:
-            page = crossref_record.get('page', None)
-        return page
+        return crossref_parse.get_page(crossref_record)
 
     def get_event_location(self, crossref_record):
         try:
@@ -53,44 +48,15 @@ class CrossrefScraper:
 
     def get_json(self, crossref_record):
         """Generate a JSON structure for the given Crossref record."""
-        try:
-            first_author = crossref_record['author'][0]['family'].capitalize()
-        except (KeyError, IndexError):
-            first_author = None
-        author = self.get_names(crossref_record, 'author')
-        title = crossref_record.get('title', [None])[0]
-        try:
-            year = crossref_record['issued']['date-parts'][0][0]
-        except (KeyError, IndexError):
-            year = None
-        doi = crossref_record.get('DOI', None)
-        crossreftype = crossref_record.get('type', None)
-        journal = self.get_journal(crossref_record)
-        pages = self.get_page(crossref_record)
-        volume = crossref_record.get('volume', None)
-        number = crossref_record.get('issue', None)
-
-        return {
-            "title": title,
-            "first_author": first_author,
-            "authors": author,
-            "year": year,
-            "doi": doi,
-            "journal": journal,
-            "pages": pages,
-            "volume": volume,
-            "number": number,
-        }
+        return crossref_parse.get_json(crossref_record, self.fix_uppercase)
 
     def debug_crossref_record(self, crossref_record):
-        """Pretty-print the given JSON record to stderr."""
-        crossref_record = crossref_record.copy()
-        try:
-            # including all references makes the record very verbose
-            del crossref_record['reference']
-        except KeyError:
-            pass
-        pprint.pprint(crossref_record, stream=sys.stderr)
+        """Log a truncated repr of the given JSON record at DEBUG level."""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        # including all references makes the record very verbose
+        crossref_record = {key: value for key, value in crossref_record.items() if key != 'reference'}
+        logger.debug("%s", _record_repr.repr(crossref_record))
 
     def _check_response(self, res):
         if isinstance(res, dict):
@@ -106,7 +72,9 @@ class CrossrefScraper:
 
     def get_json_from_doi(self, doi, debug_record=False):
         """Generate a JSON entry for the given DOI."""
-        res = self.cr.works(ids=doi)
+        response = self.session.get(f"https://api.crossref.org/works/{doi}", timeout=30)
+        response.raise_for_status()
+        res = orjson.loads(response.content)
         self._check_response(res)
         crossref_record = res['message']
         if debug_record:
@@ -117,10 +85,23 @@ class CrossrefScraper:
             print(f"WARNING: {exc_info}", file=sys.stderr)
             return habanero.cn.content_negotiation(ids=doi)
 
+    def _fetch(self, doi):
+        print(f"Fetching metadata for DOI: {doi}")
+        try:
+            return self.get_json_from_doi(doi)
+        except Exception as e:
+            print(f"Error fetching metadata for DOI '{doi}': {e}")
+            return None
+
+    def get_json_from_dois(self, dois):
+        """Fetch metadata for many DOIs on a thread pool, returning results in input order."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self._fetch, dois))
+
     def save_to_json(self, data, filename="output.json"):
         """Save the JSON data to a file."""
-        with open(filename, 'w') as json_file:
-            json.dump(data, json_file, indent=4)
+        with open(filename, 'wb') as json_file:
+            json_file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
         print(f"Data saved to {filename}")
 
 
@@ -129,33 +110,22 @@ if __name__ == "__main__":
 
     # Open the urldictclean.json file
     try:
-        with open("urldictclean.json", "r") as json_file:
-            articles = json.load(json_file)
+        with open("urldictclean.json", "rb") as json_file:
+            articles = orjson.loads(json_file.read())
     except FileNotFoundError:
         print("The file urldictclean.json was not found.")
         sys.exit(1)
 
-    # List to collect all metadata
-    all_metadata = []
-
-    # Iterate through each article in the JSON
-    for article in articles:
-        paperlinks = article.get("paperlinks", [])
-
-        # Loop through each paperlink (extracting DOI from each dictionary object)
-        for link in paperlinks:
-            doi = link.get('doi')
-            if doi:
-                print(f"Fetching metadata for DOI: {doi}")
-                try:
-                    # Fetch metadata by DOI
-                    metadata = scraper.get_json_from_doi(doi)
-
-                    if metadata:
-                        # Append the metadata to the list
-                        all_metadata.append(metadata)
-                except Exception as e:
-                    print(f"Error fetching metadata for DOI '{doi}': {e}")
+    # Collect the DOI from each paperlink of every article
+    dois = [
+        link.get('doi')
+        for article in articles
+        for link in article.get("paperlinks", [])
+        if link.get('doi')
+    ]
+
+    # Fetch metadata for all DOIs in parallel and keep the ones that succeeded
+    all_metadata = [metadata for metadata in scraper.get_json_from_dois(dois) if metadata]
 
     # Save all metadata to a single JSON file
     scraper.save_to_json(all_metadata, filename="all_metadata.json")
@@ -0,0 +1,85 @@
+# crossref_parse.py
+#
+# Parsing of Crossref work records, shared by the Crossref scrapers. Kept free of
+# scraper state and fully annotated so it can be compiled with mypyc.
+
+from functools import partial
+from operator import methodcaller
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+CrossrefRecord = Dict[str, Any]
+
+
+def get_names(crossref_record: CrossrefRecord, field: str, fix_uppercase: bool = False) -> Optional[List[str]]:
+    """Extract (author/editor) names from the Crossref record."""
+    try:
+        name_records = crossref_record[field]
+    except KeyError:
+        return None
+    names = []
+    for a in name_records:
+        family = a['family']
+        given = a['given']
+        if fix_uppercase:
+            family = family.title()
+            given = given.title()
+        names.append(family + ', ' + given)
+    return names
+
+
+def get_journal(crossref_record: CrossrefRecord) -> Optional[str]:
+    """Extract journal from the Crossref record."""
+    for key in ('short-container-title', 'container-title'):
+        for journal_name in crossref_record.get(key, []):
+            if journal_name is not None:
+                return journal_name
+    return None
+
+
+def get_page(crossref_record: CrossrefRecord) -> Optional[str]:
+    """Get page or article number from Crossref record."""
+    try:
+        return crossref_record['article-number']
+    except KeyError:
+        return crossref_record.get('page', None)
+
+
+def _title(crossref_record: CrossrefRecord) -> Optional[str]:
+    return (crossref_record.get('title') or [None])[0]
+
+
+def _first_author(crossref_record: CrossrefRecord) -> Optional[str]:
+    try:
+        return crossref_record['author'][0]['family'].capitalize()
+    except (KeyError, IndexError):
+        return None
+
+
+def _year(crossref_record: CrossrefRecord) -> Optional[int]:
+    try:
+        return crossref_record['issued']['date-parts'][0][0]
+    except (KeyError, IndexError):
+        return None
+
+
+def _field_table(fix_uppercase: bool) -> Tuple[Tuple[str, Callable[[CrossrefRecord], Any]], ...]:
+    """Output field name and extractor for each field of get_json, in output order."""
+    return (
+        ("title", _title),
+        ("first_author", _first_author),
+        ("authors", partial(get_names, field='author', fix_uppercase=fix_uppercase)),
+        ("year", _year),
+        ("doi", methodcaller('get', 'DOI')),
+        ("journal", get_journal),
+        ("pages", get_page),
+        ("volume", methodcaller('get', 'volume')),
+        ("number", methodcaller('get', 'issue')),
+    )
+
+
+_FIELDS = {False: _field_table(False), True: _field_table(True)}
+
+
+def get_json(crossref_record: CrossrefRecord, fix_uppercase: bool = False) -> Dict[str, Any]:
+    """Generate a JSON structure for the given Crossref record."""
+    return {key: extract(crossref_record) for key, extract in _FIELDS[fix_uppercase]}
@@ -1,40 +1,47 @@
 # data_models.py
 
-import json
+import msgspec
 import aiofiles
-from dataclasses import dataclass, field, asdict
-from typing import List, Optional
+from typing import List, Optional, Union
 
 
-@dataclass
-class PaperLink:
+class PaperLink(msgspec.Struct, forbid_unknown_fields=True):
     paperlink: Optional[str] = None
     doi: Optional[str] = None  # DOI can be 'N/A' or missing
 
+    def to_dict(self):
+        return msgspec.to_builtins(self)
+
 
-@dataclass
-class Article:
+class Article(msgspec.Struct, forbid_unknown_fields=True):
     title: Optional[str] = None
     url: Optional[str] = None
     author: Optional[str] = None
-    doi_urls: Optional[List[str]] = field(default_factory=list)
-    non_doi_urls: Optional[List[str]] = field(default_factory=list)
-    index: Optional[str] = None
-    paperlinks: Optional[List[PaperLink]] = field(default_factory=list)
+    doi_urls: Optional[List[str]] = []
+    non_doi_urls: Optional[List[str]] = []
+    index: Optional[Union[int, str]] = None
+    paperlinks: Optional[List[PaperLink]] = []
     count: Optional[int] = None
-    dois: Optional[List[str]] = field(default_factory=list)
+    dois: Optional[List[str]] = []
+
+    def to_dict(self):
+        return msgspec.to_builtins(self)
+
+
+# Decodes a file written by ArticleCollection.to_json straight into typed structs
+_articles_decoder = msgspec.json.Decoder(List[Article])
+_json_encoder = msgspec.json.Encoder()
 
 
-@dataclass
-class ArticleCollection:
-    articles: Optional[List[Article]] = field(default_factory=list)
+class ArticleCollection(msgspec.Struct):
+    articles: Optional[List[Article]] = []
 
     def add_article(self, article: Article):
         self.articles.append(article)
 
     def to_dict(self):
         """Convert the dataclass structure to a dictionary for JSON serialization."""
-        return {'articles': [asdict(article) for article in self.articles]}
+        return {'articles': msgspec.to_builtins(self.articles)}
 
     @classmethod
     def from_dict(cls, data: dict):
@@ -71,13 +78,16 @@ class ArticleCollection:
     @classmethod
     async def from_json(cls, filename: str):
         """Asynchronously read from a JSON file and convert to an ArticleCollection object."""
-        async with aiofiles.open(filename, 'r') as file:
+        async with aiofiles.open(filename, 'rb') as file:
             data = await file.read()
-            json_data = json.loads(data)
-            return cls.from_dict(json_data)
+        try:
+            return cls(articles=_articles_decoder.decode(data))
+        except msgspec.ValidationError:
+            # Not our own output format (e.g. a raw urldict file); map it field by field
+            return cls.from_dict(msgspec.json.decode(data))
 
     async def to_json(self, filename: str):
         """Asynchronously write the ArticleCollection object to a JSON file."""
-        async with aiofiles.open(filename, 'w') as file:
-            json_data = json.dumps(self.to_dict()['articles'], indent=4)
+        async with aiofiles.open(filename, 'wb') as file:
+            json_data = msgspec.json.format(_json_encoder.encode(self.articles), indent=2)
             await file.write(json_data)
@@ -1,38 +1,51 @@
 import argparse
-import json
-from typing import Optional
-import requests
+import asyncio
+import orjson
+from typing import List, Optional, Tuple
+import httpx
+from aiolimiter import AsyncLimiter
+
+
+# OpenAlex allows 10 requests per second
+OPENALEX_RATE_LIMIT = (10, 1)
+OPENALEX_LIMITS = httpx.Limits(max_connections=10)
 
 
 class NotFoundError(Exception):
     pass
 
 
-def get_paper_metadata(doi: Optional[str] = None, name: Optional[str] = None, url: Optional[str] = None):
-    """Fetches metadata of a paper from OpenAlex and stores specific fields in a JSON file."""
-    # Determine which field to use for the request (DOI, name, or URL)
-    if name:
-        api_res = requests.get(
-            f"https://api.openalex.org/works?search={name}&per-page=1&page=1&sort=relevance_score:desc"
-        )
-    elif doi:
-        api_res = requests.get(f"https://api.openalex.org/works/https://doi.org/{doi}")
+def api_url(field: str, value: str) -> str:
+    """Build the OpenAlex API URL for a DOI, paper name, or URL."""
+    if field == "name":
+        return f"https://api.openalex.org/works?search={value}&per-page=1&page=1&sort=relevance_score:desc"
+    elif field == "doi":
+        return f"https://api.openalex.org/works/https://doi.org/{value}"
+    elif field == "url":
+        return f"https://api.openalex.org/works/{value}"
+    raise ValueError("Either DOI, name, or URL must be provided.")
 
-    elif url:
-        api_res = requests.get(f"https://api.openalex.org/works/{url}")
 
-    else:
-        raise ValueError("Either DOI, name, or URL must be provided.")
+async def fetch_one(client: httpx.AsyncClient, key: Tuple[str, str], limiter: AsyncLimiter) -> dict:
+    """Fetches metadata of a paper from OpenAlex, where key is a ("doi" | "name" | "url", value) pair."""
+    field, value = key
+    url = api_url(field, value)
+    async with limiter:
+        api_res = await client.get(url)
 
     # Check if the request was successful
     if api_res.status_code != 200:
-        raise NotFoundError(f"API request failed with status code {api_res.status_code}")
+        raise NotFoundError(f"API request for {field} {value} failed with status code {api_res.status_code}")
 
-    metadata = api_res.json()
-    print(metadata)
+    metadata = orjson.loads(api_res.content)
+    if field == "name":
+        # A search returns a page of results; take the best match
+        if not metadata.get("results"):
+            raise NotFoundError(f"No paper found for name {value}")
+        metadata = metadata["results"][0]
 
     # Extract the relevant fields
-    paper_metadata = {
+    return {
         "doi": metadata.get("doi", "Not available"),
         "mag": metadata.get("ids", {}).get("mag", "Not available"),
         "pmid": metadata.get("ids", {}).get("pmid", "Not available"),
@@ -48,12 +61,29 @@ def get_paper_metadata(doi: Optional[str] = None, name: Optional[str] = None, ur
         "field": metadata.get("primary_topic", {}).get("field", {}).get("display_name", "Not available")
     }
 
-    # Save the extracted data to a JSON file
-    with open("paper_metadata.json", "w") as json_file:
-        json.dump(paper_metadata, json_file, indent=4)
 
-    print(f"Specific paper metadata stored in 'paper_metadata.json'")
-    return paper_metadata
+async def fetch_many(keys: List[Tuple[str, str]]) -> List[Optional[dict]]:
+    """Fetches metadata for many papers concurrently, returning None for those that could not be fetched."""
+    # One HTTP/2 connection pool and rate limiter shared by every request, within OpenAlex's 10 requests/second
+    limiter = AsyncLimiter(*OPENALEX_RATE_LIMIT)
+    async with httpx.AsyncClient(http2=True, limits=OPENALEX_LIMITS, timeout=30) as client:
+        results = await asyncio.gather(*(fetch_one(client, key, limiter) for key in keys), return_exceptions=True)
+
+    papers = []
+    for (field, value), result in zip(keys, results):
+        if isinstance(result, Exception):
+            print(f"Failed to fetch metadata for {field} {value}: {result}")
+            result = None
+        papers.append(result)
+    return papers
+
+
+def save_metadata(paper_metadata, filename: str = "paper_metadata.json"):
+    """Stores the extracted paper metadata in a JSON file."""
+    with open(filename, "wb") as json_file:
+        json_file.write(orjson.dumps(paper_metadata, option=orjson.OPT_INDENT_2))
+
+    print(f"Specific paper metadata stored in '{filename}'")
 
 
 def main():
@@ -61,9 +91,9 @@ def main():
         description="Retrieves specific metadata of a research paper based on DOI, name, or URL and stores it in a JSON file."
     )
 
-    parser.add_argument("--doi", type=str, help="DOI of the research paper.", metavar="DOI")
-    parser.add_argument("--name", type=str, help="Name of the research paper.", metavar="name")
-    parser.add_argument("--url", type=str, help="URL of the research paper.", metavar="url")
+    parser.add_argument("--doi", type=str, nargs="+", help="DOIs of the research papers.", metavar="DOI")
+    parser.add_argument("--name", type=str, nargs="+", help="Names of the research papers.", metavar="name")
+    parser.add_argument("--url", type=str, nargs="+", help="URLs of the research papers.", metavar="url")
 
     args = parser.parse_args()
 
@@ -73,8 +103,11 @@ def main():
     if len([arg for arg in (args.doi, args.name, args.url) if arg is not None]) > 1:
         parser.error("Only one of --doi, --name, --url must be specified.")
 
-    # Retrieve metadata and store it in a JSON file
-    get_paper_metadata(doi=args.doi, name=args.name, url=args.url)
+    field, values = next((field, values) for field, values in vars(args).items() if values)
+
+    # Retrieve metadata concurrently and store it in a JSON file
+    papers = asyncio.run(fetch_many([(field, value) for value in values]))
+    save_metadata(papers[0] if len(papers) == 1 else papers)
 
 
 if __name__ == "__main__":
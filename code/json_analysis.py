@@ -1,8 +1,8 @@
-import json
-from collections import defaultdict
-from typing import Dict, List, Union, Any
+import ijson
+from collections import Counter
+from typing import Dict, List, Union
 
-def analyze_json_duplicates(json_file: str, key_paths: Dict[str, List[Union[str, List[str]]]]):
+def analyze_json_duplicates(json_file: str, key_paths: Dict[str, List[Union[str, List[str]]]], with_ids: bool = True):
     """
     Analyze a JSON file for duplicates based on specified keys.
 
@@ -12,6 +12,8 @@ def analyze_json_duplicates(json_file: str, key_paths: Dict[str, List[Union[str,
       The keys of this dictionary are the names of the counters (e.g., 'doi', 'url').
       The values are lists that represent the path to the value in the JSON data.
       Each element in the list can be a string (key) or a list (for iterating over a list of items).
+    - with_ids (bool): Report the IDs of the items each duplicate is found in.
+      When False only occurrence counts are kept.
 
     Example of key_paths:
     {
@@ -20,39 +22,54 @@ def analyze_json_duplicates(json_file: str, key_paths: Dict[str, List[Union[str,
         'sciencealert': ['sciencealert']
     }
     """
-    # Load the JSON data
-    with open(json_file, 'r') as file:
-        data = json.load(file)
-
-    # Initialize counters
-    counters = {key: defaultdict(list) for key in key_paths.keys()}
-
-    # Handle both list and dict data structures
-    if isinstance(data, dict):
-        data_items = data.items()
-    elif isinstance(data, list):
-        data_items = enumerate(data)
-    else:
-        raise ValueError("Unsupported JSON data structure. Must be a list or a dictionary.")
-
-    # Iterate over each item in the data
-    for item_id, item_data in data_items:
-        # For each key we want to analyze
-        for counter_name, path in key_paths.items():
-            values = extract_values_from_path(item_data, path)
-            for value in values:
-                if value:
-                    counters[counter_name][value].append(item_id)
-
-    # Find duplicates
-    duplicates = {
-        key: {value: ids for value, ids in counter.items() if len(ids) > 1}
-        for key, counter in counters.items()
-    }
+    # Merge the key paths into one trie so each item is walked once for all counters
+    trie = build_path_trie(key_paths)
+
+    # Initialize counters. With IDs, a value's first ID is remembered and its ID
+    # list is only allocated once a second occurrence makes it a duplicate.
+    counts = {key: Counter() for key in key_paths}
+    first_ids = {key: {} for key in key_paths}
+    duplicates = {key: {} for key in key_paths}
+
+    # Stream the items instead of loading the whole document
+    with open(json_file, 'rb') as file:
+        # Handle both list and dict data structures
+        root = file.read(4096).lstrip()[:1]  # Peek at the opening bracket
+        file.seek(0)
+        if root == b'{':
+            data_items = ijson.kvitems(file, '')
+        elif root == b'[':
+            data_items = enumerate(ijson.items(file, 'item'))
+        else:
+            raise ValueError("Unsupported JSON data structure. Must be a list or a dictionary.")
+
+        # Iterate over each item in the data
+        for item_id, item_data in data_items:
+            for counter_name, value in visit_paths(item_data, trie):
+                if not value:
+                    continue
+                if not with_ids:
+                    counts[counter_name][value] += 1
+                    continue
+                seen = first_ids[counter_name]
+                if value not in seen:
+                    seen[value] = item_id
+                elif value in duplicates[counter_name]:
+                    duplicates[counter_name][value].append(item_id)
+                else:
+                    duplicates[counter_name][value] = [seen[value], item_id]
+
+    if not with_ids:
+        duplicates = {
+            key: {value: count for value, count in counter.items() if count > 1}
+            for key, counter in counts.items()
+        }
 
     # Calculate totals
     totals = {
-        f"total_{key}_duplicates": sum(len(ids) for ids in duplicate_counter.values())
+        f"total_{key}_duplicates": sum(
+            len(ids) if with_ids else ids for ids in duplicate_counter.values()
+        )
         for key, duplicate_counter in duplicates.items()
     }
 
@@ -60,49 +77,62 @@ def analyze_json_duplicates(json_file: str, key_paths: Dict[str, List[Union[str,
     for key, duplicate_counter in duplicates.items():
         print(f"\nDuplicate {key.upper()}s with Item IDs:")
         for value, ids in duplicate_counter.items():
-            print(f"{value}: {len(ids)} occurrences, found in items: {ids}")
+            if with_ids:
+                print(f"{value}: {len(ids)} occurrences, found in items: {ids}")
+            else:
+                print(f"{value}: {ids} occurrences")
 
     # Print total duplicates
     for key, total in totals.items():
         print(f"\nTotal duplicates for {key.split('_')[1].upper()}s: {total}")
 
-def extract_values_from_path(data_item: Any, path: List[Union[str, List[str]]]) -> List[Any]:
+def build_path_trie(key_paths: Dict[str, List[Union[str, List[str]]]]) -> dict:
     """
-    Extract values from a data item based on the provided path.
+    Merge key paths into a trie keyed by path step.
 
     Parameters:
-    - data_item (Any): The data item (dict) to extract values from.
-    - path (List[Union[str, List[str]]]): The path to navigate through the data item.
+    - key_paths (dict): Counter names mapped to their paths, as for analyze_json_duplicates.
 
     Returns:
-    - List[Any]: A list of extracted values.
+    - dict: The root node. Each node has 'counters', the names of the paths ending there,
+      and 'children', mapping a step (is_each, key) to the next node. is_each marks a step
+      taken from every element of a list, e.g. ['urls', ['doi']] is (False, 'urls') then (True, 'doi').
+    """
+    root = {'counters': [], 'children': {}}
+    for counter_name, path in key_paths.items():
+        nodes = [root]
+        for key in path:
+            is_each = isinstance(key, list)
+            next_nodes = []
+            for node in nodes:
+                for sub_key in (key if is_each else [key]):
+                    child = node['children'].setdefault((is_each, sub_key), {'counters': [], 'children': {}})
+                    next_nodes.append(child)
+            nodes = next_nodes
+        for node in nodes:
+            node['counters'].append(counter_name)
+    return root
+
+def visit_paths(data, node: dict):
     """
-    values = [data_item]
-    for key in path:
-        if isinstance(key, list):
-            # We need to iterate over a list in the data
-            new_values = []
-            for value in values:
-                if isinstance(value, list):
-                    for item in value:
-                        for sub_key in key:
-                            extracted_value = item.get(sub_key)
-                            new_values.append(extracted_value)
-                elif isinstance(value, dict):
-                    for sub_key in key:
-                        extracted_value = value.get(sub_key)
-                        new_values.append(extracted_value)
-            values = new_values
+    Walk a data item once, yielding (counter_name, value) for every path in the trie that reaches a value.
+    A list found at the end of a path yields each of its elements.
+    """
+    for counter_name in node['counters']:
+        if isinstance(data, list):
+            for value in data:
+                yield counter_name, value
+        else:
+            yield counter_name, data
+    for (is_each, key), child in node['children'].items():
+        if is_each:
+            # An each-step takes the key from every item of a list, or from a single dict
+            elements = data if isinstance(data, list) else (data,) if isinstance(data, dict) else ()
         else:
-            # Navigate to the next key in all current values
-            new_values = []
-            for value in values:
-                if isinstance(value, dict):
-                    new_value = value.get(key)
-                    if new_value is not None:
-                        new_values.append(new_value)
-            values = new_values
-    return values
+            elements = (data,)
+        for element in elements:
+            if isinstance(element, dict) and key in element:
+                yield from visit_paths(element[key], child)
 
 # Example usage:
 
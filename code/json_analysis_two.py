@@ -1,45 +1,40 @@
-import json
-from collections import defaultdict
-
-# Load the JSON data
-with open('urldictcleandoistwo.json', 'r') as file:
-    data = json.load(file)
-
-# Initialize variables for analysis
-doi_counter = defaultdict(list)
-url_counter = defaultdict(list)
-sciencealert_counter = defaultdict(list)
-
-# Iterate over each article in the data using the article ID
-for article in data:
-    # Count the ScienceAlert link for this article
-    sciencealert_link = article.get("url")
-    if sciencealert_link and "sciencealert.com" in sciencealert_link:
-        sciencealert_counter[sciencealert_link].append(article["index"])
-
-    # Iterate over paperlinks
-    paperlinks = article.get("paperlinks", [])
-    for link_info in paperlinks:
-        paperlink = link_info.get("paperlink")
-        doi = link_info.get("doi")
-
-        # Track DOI occurrences and their corresponding article IDs
-        if doi and doi != "N/A":
-            doi_counter[doi].append(article["index"])
-
-        # Track URL occurrences and their corresponding article IDs
-        if paperlink:
-            url_counter[paperlink].append(article["index"])
+import ijson
+import pandas as pd
+
+
+def duplicate_groups(df, column):
+    """Group the article IDs of every value in `column` that occurs more than once."""
+    duplicates = df[df.duplicated(column, keep=False)]
+    return duplicates.groupby(column, sort=False)['index'].apply(lambda ids: ids.tolist())
+
+
+# Stream the articles one at a time, keeping only the fields we count:
+# one row per article, and one row per paperlink tagged with its article ID
+article_rows, link_rows = [], []
+with open('urldictcleandoistwo.json', 'rb') as file:
+    for article in ijson.items(file, 'item'):
+        article_rows.append((article["index"], article.get("url")))
+        for link_info in article.get("paperlinks") or []:
+            link_rows.append((link_info.get("paperlink"), link_info.get("doi"), article["index"]))
+
+article_rows = pd.DataFrame(article_rows, columns=['index', 'url'])
+links = pd.DataFrame(link_rows, columns=['paperlink', 'doi', 'index'])
+del link_rows
+
+# Only count real DOIs, non-empty paperlinks and ScienceAlert article links
+dois = links[links['doi'].notna() & (links['doi'] != '') & (links['doi'] != 'N/A')]
+urls = links[links['paperlink'].notna() & (links['paperlink'] != '')]
+sciencealert = article_rows[article_rows['url'].str.contains('sciencealert.com', regex=False, na=False)]
 
 # Find duplicate DOIs and URLs
-duplicate_dois = {doi: articles for doi, articles in doi_counter.items() if len(articles) > 1}
-duplicate_urls = {url: articles for url, articles in url_counter.items() if len(articles) > 1}
-duplicate_sciencealert = {link: articles for link, articles in sciencealert_counter.items() if len(articles) > 1}
+duplicate_dois = duplicate_groups(dois, 'doi')
+duplicate_urls = duplicate_groups(urls, 'paperlink')
+duplicate_sciencealert = duplicate_groups(sciencealert, 'url')
 
 # Calculate total duplicates
-total_duplicate_dois = sum(len(articles) for articles in duplicate_dois.values())
-total_duplicate_urls = sum(len(articles) for articles in duplicate_urls.values())
-total_duplicate_sciencealert = sum(len(articles) for articles in duplicate_sciencealert.values())
+total_duplicate_dois = sum(len(articles) for articles in duplicate_dois)
+total_duplicate_urls = sum(len(articles) for articles in duplicate_urls)
+total_duplicate_sciencealert = sum(len(articles) for articles in duplicate_sciencealert)
 
 # Print the duplicate DOIs, URLs, and ScienceAlert links with the corresponding article IDs
 print("Duplicate DOIs with Article IDs:")
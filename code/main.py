@@ -1,11 +1,13 @@
 # main.py
 
 import sys
+import time
 import asyncio
 from loguru import logger
-import json
+import ijson
 from collections import defaultdict
-from typing import Dict, List, Union, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple, Union, Any
 
 from data_models import Article, ArticleCollection
 from base_classes import BaseCleaner
@@ -34,6 +36,13 @@ def setup_article_template() -> Article:
     )
 
 def main():
+    # uvloop runs the many small aiohttp coroutines with less per-callback overhead; optional
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     print("Welcome to the ScienceAlert Scraper and Analyzer!")
     print("What would you like to do?")
     print("1. Scrape articles from ScienceAlert")
@@ -100,7 +109,7 @@ def main():
             print("Invalid choice. Returning to main menu.")
             return
 
-        analyze_json_duplicates(json_file, key_paths)
+        asyncio.run(analyze_json_duplicates_async(json_file, key_paths))
 
     elif choice == '3':
         # Clean data
@@ -176,39 +185,65 @@ def analyze_json_duplicates(json_file: str, key_paths: Dict[str, List[Union[str,
         'sciencealert': ['sciencealert']
     }
     """
-    # Load the JSON data
     try:
-        with open(json_file, 'r') as file:
-            data = json.load(file)
+        duplicates, totals = _count_dups(json_file, key_paths)
     except Exception as e:
         logger.error(f"Error loading JSON file {json_file}: {e}")
         return
 
-    # Initialize counters
-    counters = {key: defaultdict(list) for key in key_paths.keys()}
+    print_duplicates(duplicates, totals)
 
-    # Handle both list and dict data structures
-    if isinstance(data, dict):
-        data_items = data.items()
-    elif isinstance(data, list):
-        data_items = enumerate(data)
-    else:
-        logger.error("Unsupported JSON data structure. Must be a list or a dictionary.")
+async def analyze_json_duplicates_async(json_file: str, key_paths: Dict[str, List[Union[str, List[str]]]]):
+    """
+    Analyze a JSON file for duplicates like analyze_json_duplicates, but count in a worker process
+    so the parse and dedupe run off the event loop while progress is reported.
+
+    Parameters:
+    - json_file (str): The path to the JSON file.
+    - key_paths (dict): A dictionary specifying the keys to analyze, as for analyze_json_duplicates.
+    """
+    loop = asyncio.get_running_loop()
+    progress = asyncio.create_task(_report_progress(json_file))
+    try:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            duplicates, totals = await loop.run_in_executor(executor, _count_dups, json_file, key_paths)
+    except Exception as e:
+        logger.error(f"Error loading JSON file {json_file}: {e}")
         return
+    finally:
+        progress.cancel()
+
+    print_duplicates(duplicates, totals)
+
+async def _report_progress(json_file: str, interval: float = 5.0):
+    # Runs until cancelled, so long analyses show they are still working
+    started = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        print(f"Still analyzing {json_file}... {time.monotonic() - started:.0f}s elapsed")
 
-    # Iterate over each item in the data
-    for item_id, item_data in data_items:
-        # For each key we want to analyze
-        for counter_name, path in key_paths.items():
-            values = extract_values_from_path(item_data, path)
-            for value in values:
+def _count_dups(json_file: str, key_paths: Dict[str, List[Union[str, List[str]]]]) -> Tuple[Dict[str, Dict[Any, List[Any]]], Dict[str, int]]:
+    """
+    Count the duplicated values in a JSON file. Top-level so it can run in a worker process.
+
+    Returns:
+    - Tuple: The item IDs of each duplicated value per counter, and the total duplicates per counter.
+    """
+    # Compile each path into its steps once, rather than interpreting it for every item
+    compiled = {counter_name: compile_path(path) for counter_name, path in key_paths.items()}
+
+    # One pass collects the item IDs of every value; values seen only once are dropped afterwards
+    occurrences = {key: defaultdict(list) for key in key_paths.keys()}
+    for item_id, item_data in iter_json_items(json_file):
+        for counter_name, steps in compiled.items():
+            values = occurrences[counter_name]
+            for value in extract_values_from_path(item_data, steps):
                 if value:
-                    counters[counter_name][value].append(item_id)
+                    values[value].append(item_id)
 
-    # Find duplicates
     duplicates = {
-        key: {value: ids for value, ids in counter.items() if len(ids) > 1}
-        for key, counter in counters.items()
+        key: {value: ids for value, ids in values.items() if len(ids) > 1}
+        for key, values in occurrences.items()
     }
 
     # Calculate totals
@@ -216,7 +251,10 @@ def analyze_json_duplicates(json_file: str, key_paths: Dict[str, List[Union[str,
         f"total_{key}_duplicates": sum(len(ids) for ids in duplicate_counter.values())
         for key, duplicate_counter in duplicates.items()
     }
+    return duplicates, totals
 
+def print_duplicates(duplicates: Dict[str, Dict[Any, List[Any]]], totals: Dict[str, int]):
+    """Print the duplicated values with their item IDs, followed by the totals."""
     # Print the results
     for key, duplicate_counter in duplicates.items():
         print(f"\nDuplicate {key.upper()}s with Item IDs:")
@@ -227,42 +265,74 @@ def analyze_json_duplicates(json_file: str, key_paths: Dict[str, List[Union[str,
     for key, total in totals.items():
         print(f"\nTotal duplicates for {key.split('_')[1].upper()}s: {total}")
 
-def extract_values_from_path(data_item: Any, path: List[Union[str, List[str]]]) -> List[Any]:
+def iter_json_items(json_file: str) -> Iterator[Tuple[Any, Any]]:
     """
-    Extract values from a data item based on the provided path.
+    Stream (item_id, item_data) pairs from a JSON file one at a time instead of loading the whole document.
+
+    Parameters:
+    - json_file (str): The path to a JSON file holding a list or a dictionary of items.
+
+    Returns:
+    - Iterator[Tuple[Any, Any]]: List indices or dictionary keys paired with their items.
+    """
+    with open(json_file, 'rb') as file:
+        # Handle both list and dict data structures
+        root = file.read(4096).lstrip()[:1]  # Peek at the opening bracket
+        file.seek(0)
+        if root == b'{':
+            yield from ijson.kvitems(file, '', use_float=True)
+        elif root == b'[':
+            yield from enumerate(ijson.items(file, 'item', use_float=True))
+        else:
+            raise ValueError("Unsupported JSON data structure. Must be a list or a dictionary.")
+
+def _step_key(values: List[Any], key: str) -> List[Any]:
+    # Navigate to the next key of every dict; exact type checks are cheaper than isinstance
+    return [value[key] for value in values if type(value) is dict and value.get(key) is not None]
+
+def _step_iter(values: List[Any], sub_keys: Tuple[str, ...]) -> List[Any]:
+    # Take each sub key from every item of a list (or from a single dict)
+    new_values = []
+    for value in values:
+        if type(value) is list:
+            new_values.extend([item.get(sub_key) for item in value for sub_key in sub_keys])
+        elif type(value) is dict:
+            new_values.extend([value.get(sub_key) for sub_key in sub_keys])
+    return new_values
+
+# Path opcodes, each mapping the current values to the values one step further along the path
+STEPS = {"key": _step_key, "iter_keys": _step_iter}
+
+def compile_path(path: List[Union[str, List[str]]]) -> Tuple[Tuple[str, Any], ...]:
+    """
+    Compile a path into a tuple of (opcode, argument) steps, resolving the shape of each path element once.
+
+    Parameters:
+    - path (List[Union[str, List[str]]]): The path to navigate through a data item,
+      e.g. ['urls', ['doi']] becomes (("key", "urls"), ("iter_keys", ("doi",))).
+
+    Returns:
+    - Tuple[Tuple[str, Any], ...]: The steps, run in order by extract_values_from_path.
+    """
+    return tuple(
+        ("iter_keys", tuple(key)) if isinstance(key, list) else ("key", key)
+        for key in path
+    )
+
+def extract_values_from_path(data_item: Any, ops: Tuple[Tuple[str, Any], ...]) -> List[Any]:
+    """
+    Extract values from a data item using a compiled path.
 
     Parameters:
     - data_item (Any): The data item (dict) to extract values from.
-    - path (List[Union[str, List[str]]]): The path to navigate through the data item.
+    - ops (Tuple[Tuple[str, Any], ...]): The path compiled by compile_path.
 
     Returns:
     - List[Any]: A list of extracted values.
     """
     values = [data_item]
-    for key in path:
-        if isinstance(key, list):
-            # We need to iterate over a list in the data
-            new_values = []
-            for value in values:
-                if isinstance(value, list):
-                    for item in value:
-                        for sub_key in key:
-                            extracted_value = item.get(sub_key)
-                            new_values.append(extracted_value)
-                elif isinstance(value, dict):
-                    for sub_key in key:
-                        extracted_value = value.get(sub_key)
-                        new_values.append(extracted_value)
-            values = new_values
-        else:
-            # Navigate to the next key in all current values
-            new_values = []
-            for value in values:
-                if isinstance(value, dict):
-                    new_value = value.get(key)
-                    if new_value is not None:
-                        new_values.append(new_value)
-            values = new_values
+    for opcode, argument in ops:
+        values = STEPS[opcode](values, argument)
     return values
 
 if __name__ == "__main__":
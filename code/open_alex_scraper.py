@@ -1,107 +1,206 @@
 import aiohttp
 import asyncio
+import collections
+import diskcache
+import functools
 import logging
-import json
+import msgspec
+from typing import List, Optional, Union
 from urllib.parse import urlparse, urlunparse
-from utils import get_working_proxies
+from utils import get_working_proxies, normalize_doi
 # Configure logging
 logging.basicConfig(filename='error_log.txt', level=logging.ERROR)
 
+# OpenAlex works by DOI, stored on disk so each entry is written once and read on demand
+METADATA_CACHE_DIR = './metadata_cache/openalex_papers'
+
+# Time allowed for resolving a link's redirects
+REDIRECT_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+
+# The subset of an OpenAlex work that get_paper_metadata reports. Defaults stand in for missing fields.
+class Author(msgspec.Struct):
+    display_name: Optional[str] = None
+
+
+class Authorship(msgspec.Struct):
+    author: Author = msgspec.field(default_factory=Author)
+
+
+class Venue(msgspec.Struct):
+    display_name: Optional[str] = "Unknown Institution"
+
+
+class Biblio(msgspec.Struct):
+    first_page: Optional[str] = ''
+    last_page: Optional[str] = ''
+    volume: Optional[str] = ''
+    issue: Optional[str] = ''
+
+
+class Work(msgspec.Struct):
+    display_name: Optional[str] = "No Title Available"
+    doi: Optional[str] = None
+    publication_year: Union[int, str, None] = "Unknown Year"
+    authorships: List[Authorship] = []
+    host_venue: Optional[Venue] = msgspec.field(default_factory=Venue)
+    biblio: Biblio = msgspec.field(default_factory=Biblio)
+
+
+_work_decoder = msgspec.json.Decoder(Work)
+
+
 class OpenAlexScraper:
-    def __init__(self, proxies=None, metadata_file='all_metadata.json'):
+    def __init__(self, proxies=None, cache_dir=METADATA_CACHE_DIR, max_concurrency=32):
         self.proxies = get_working_proxies(refresh=True)
         self.request_count = 0
-        self.metadata_file = metadata_file
-        self.metadata_cache = self.load_metadata_cache()
+        self.metadata_cache = diskcache.Cache(cache_dir)
+        self._session = None  # Shared aiohttp session, opened on first use by _ensure_session
+        self.max_concurrency = max_concurrency
+        self._sem = asyncio.Semaphore(max_concurrency)  # Caps the links processed at once
+        self._inflight = {}  # DOI or URL -> future of the lookup already running for it
+        # Proxies are handed out round-robin; ones that fail to connect are skipped from then on
+        self._proxy_ring = collections.deque(self.proxies or [])
+        self._failed_proxies = set()
 
-    def load_metadata_cache(self):
-        """Load previous metadata from all_metadata.json if it exists."""
-        try:
-            with open(self.metadata_file, 'r') as file:
-                return json.load(file)
-        except FileNotFoundError:
-            logging.info(f"Metadata file {self.metadata_file} not found. Starting with an empty cache.")
-            return {}
-        except json.JSONDecodeError:
-            logging.error(f"Error decoding JSON from {self.metadata_file}. Starting with an empty cache.")
-            return {}
+    def _next_proxy(self):
+        """Return the next working proxy in the rotation, or None (a direct connection) if none are left."""
+        for _ in range(len(self._proxy_ring)):
+            proxy = self._proxy_ring[0]
+            self._proxy_ring.rotate(-1)
+            if proxy not in self._failed_proxies:
+                return proxy
+        return None
 
-    async def save_metadata_cache(self):
-        """Save the current metadata cache to all_metadata.json."""
-        with open(self.metadata_file, 'w') as file:
-            json.dump(self.metadata_cache, file, indent=4)
+    async def _ensure_session(self):
+        """Return the shared session, creating it if it is not open so requests reuse keep-alive connections."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=10, ttl_dns_cache=300, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
 
-    async def get_paper_metadata(self, doi=None, url=None):
-        """Fetch metadata of a paper from OpenAlex API using DOI or URL asynchronously."""
+    async def close(self):
+        """Close the shared session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_paper_metadata(self, doi=None, url=None, proxy=None):
+        """
+        Fetch metadata of a paper from OpenAlex API using DOI or URL asynchronously, optionally through a proxy.
+        When a DOI is given the URL is ignored, so no request is spent resolving its redirects.
+        """
         if not any([doi, url]):
             raise ValueError("At least one of 'doi' or 'url' must be provided.")
+        if doi:
+            doi = normalize_doi(doi)
 
         # Check if metadata is already in the cache
-        if doi and doi in self.metadata_cache:
+        cached = self.metadata_cache.get(doi) if doi else None
+        if cached is not None:
             logging.info(f"Returning cached metadata for DOI {doi}")
-            return self.metadata_cache[doi]
-
-        async with aiohttp.ClientSession() as session:
-            if doi:
-                doi = doi.replace("https://doi.org/", "")
-                api_url = f"https://api.openalex.org/works/doi:{doi}"
-            elif url:
-                final_url = await self.follow_redirects(url)
-                final_url = self.clean_url(final_url)  # Clean the final URL
-                api_url = f"https://api.openalex.org/works/{final_url}"
-
-            try:
-                async with session.get(api_url) as response:
-                    if response.status == 404:
-                        logging.error(f"Error: Received status code 404 for {doi or url}. Resource not found.")
-                        return {"error": f"Could not find metadata for {doi or url}"}
-                    if response.status != 200:
-                        logging.error(f"Error: Received status code {response.status} for {doi or url}.")
-                        return {"error": f"Error: Received status code {response.status} for {doi or url}"}
-                    metadata = await response.json()
-            except Exception as e:
-                logging.error(f"Error fetching metadata for {doi or url}: {e}")
-                return {"error": f"Could not fetch metadata for {doi or url}"}
-
-        doi = metadata.get("doi", None)
+            return cached
+
+        # Concurrent lookups of the same DOI or URL share a single request
+        key = doi or url
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._fetch_paper_metadata(doi=doi, url=url, proxy=proxy)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved so an exception no one else awaits isn't reported as unhandled
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _fetch_paper_metadata(self, doi=None, url=None, proxy=None):
+        session = await self._ensure_session()
+        proxy_url = f"http://{proxy}" if proxy else None
         if doi:
-            doi = doi[len("https://doi.org/"):]  # Strip the DOI URL prefix
-        title = metadata.get("display_name", "No Title Available")
+            api_url = f"https://api.openalex.org/works/doi:{doi}"
+        elif url:
+            final_url = await self.follow_redirects(url, proxy=proxy)
+            final_url = self.clean_url(final_url)  # Clean the final URL
+            api_url = f"https://api.openalex.org/works/{final_url}"
+
+        try:
+            async with session.get(api_url, proxy=proxy_url) as response:
+                if response.status == 404:
+                    logging.error(f"Error: Received status code 404 for {doi or url}. Resource not found.")
+                    return {"error": f"Could not find metadata for {doi or url}"}
+                if response.status != 200:
+                    logging.error(f"Error: Received status code {response.status} for {doi or url}.")
+                    return {"error": f"Error: Received status code {response.status} for {doi or url}"}
+                # Decode straight into the fields we use
+                work = _work_decoder.decode(await response.read())
+        except (aiohttp.ClientProxyConnectionError, aiohttp.ClientHttpProxyError) as e:
+            logging.error(f"Proxy {proxy} failed fetching metadata for {doi or url}: {e}")
+            self._failed_proxies.add(proxy)
+            return {"error": f"Could not fetch metadata for {doi or url} (proxy failure)"}
+        except Exception as e:
+            logging.error(f"Error fetching metadata for {doi or url}: {e}")
+            return {"error": f"Could not fetch metadata for {doi or url}"}
+
+        doi = normalize_doi(work.doi) if work.doi else None
 
         self.request_count += 1
 
-        # Cache the fetched metadata
-        if doi:
-            self.metadata_cache[doi] = metadata
-            await self.save_metadata_cache()
-
-        return {
-            "title": metadata.get("display_name", "No Title Available"),
-            "first_author": metadata["authorships"][0]["author"]["display_name"] if metadata.get(
-                "authorships") else "No Author",
-            "authors": ", ".join([author["author"]["display_name"] for author in metadata.get("authorships", [])]),
-            "year": metadata.get("publication_year", "Unknown Year"),
+        paper = {
+            "title": work.display_name,
+            "first_author": work.authorships[0].author.display_name if work.authorships else "No Author",
+            "authors": ", ".join([authorship.author.display_name for authorship in work.authorships]),
+            "year": work.publication_year,
             "doi": doi,
-            "doi_url": metadata.get("doi", "No DOI available"),
-            "journal_or_institution": metadata.get("host_venue", {}).get("display_name", "Unknown Institution"),
-            "pages": f"{metadata['biblio'].get('first_page', '')}-{metadata['biblio'].get('last_page', '')}",
-            "volume": metadata["biblio"].get("volume", ""),
-            "number": metadata["biblio"].get("issue", "")
+            "doi_url": work.doi or "No DOI available",
+            "journal_or_institution": (work.host_venue or Venue()).display_name,
+            "pages": f"{work.biblio.first_page}-{work.biblio.last_page}",
+            "volume": work.biblio.volume,
+            "number": work.biblio.issue
         }
 
-    async def follow_redirects(self, url):
+        # Cache the formatted metadata, so cache hits return the same shape as fresh fetches
+        if doi:
+            self.metadata_cache.set(doi, paper)
+
+        return paper
+
+    async def follow_redirects(self, url, proxy=None):
         """Follow redirects to get the final URL."""
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url, allow_redirects=True) as response:
-                    final_url = str(response.url)  # Get the final URL after redirects
-                    return final_url
-            except Exception as e:
-                logging.error(f"Error following URL {url}: {str(e)}")
-                return url  # Return the original URL if there's an error
-
-    def clean_url(self, url):
+        session = await self._ensure_session()
+        proxy_url = f"http://{proxy}" if proxy else None
+        try:
+            # HEAD fetches the headers only; the final URL is all we need
+            async with session.head(url, allow_redirects=True, max_redirects=10, timeout=REDIRECT_TIMEOUT, proxy=proxy_url) as response:
+                if response.status not in (405, 501):
+                    return str(response.url)  # Get the final URL after redirects
+            # The server doesn't support HEAD; fall back to GET and drop the body unread
+            async with session.get(url, allow_redirects=True, max_redirects=10, timeout=REDIRECT_TIMEOUT, proxy=proxy_url) as response:
+                response.release()
+                return str(response.url)
+        except Exception as e:
+            logging.error(f"Error following URL {url}: {str(e)}")
+            return url  # Return the original URL if there's an error
+
+    @staticmethod
+    @functools.lru_cache(maxsize=131072)
+    def clean_url(url):
         """Clean the URL by removing query parameters, fragments, and specific cases with urllib and custom logic."""
+        # Most URLs need none of the rewrites below; skip parsing them
+        if not ('?' in url or '#' in url or '/full' in url or '/abstract' in url):
+            return url
+
         if url.startswith("https://psycnet.apa.org/doiLanding?doi="):
             return url.split('=')[-1]  # Extract DOI part
 
@@ -120,14 +219,16 @@ class OpenAlexScraper:
 
         return cleaned_url
 
-    async def process_link(self, link, proxy=None):
-        """Process each link and fetch metadata using a specific proxy."""
+    async def process_link(self, link):
+        """Process each link and fetch metadata through the next working proxy."""
         try:
             doi = link.get('doi', None)
             url = link.get('url', None)
 
-            # Fetch metadata using either DOI or URL
-            paper_data = await self.get_paper_metadata(doi=doi, url=url)
+            # Fetch metadata by DOI when there is one; only bare URLs need their redirects followed
+            async with self._sem:
+                # Pick the proxy only once a slot is free, so proxies that failed meanwhile are skipped
+                paper_data = await self.get_paper_metadata(doi=doi, url=None if doi else url, proxy=self._next_proxy())
 
             # Check if there was an error in fetching metadata
             if "error" in paper_data:
@@ -156,37 +257,23 @@ class OpenAlexScraper:
             return {}
 
         all_processed_papers = {}
-        proxy_index = 0
-        failed_proxies = set()  # Keep track of proxies that fail
-
-        tasks = []
+        # Links repeated in the input are fetched once; they share a result key (DOI or URL) anyway
+        unique_links = {}
         for link in links:
-            # Skip failed proxies to avoid retrying them
-            if self.proxies:
-                while self.proxies and proxy_index < len(self.proxies):
-                    proxy = self.proxies[proxy_index]
-                    if proxy in failed_proxies:
-                        proxy_index = (proxy_index + 1) % len(self.proxies)
-                        continue
-                    break
-                else:
-                    proxy = None
-            else:
-                proxy = None
-
-            tasks.append(self.process_link(link, proxy))
+            unique_links.setdefault((link.get('doi'), link.get('url')), link)
+        if len(unique_links) < len(links):
+            logging.info(f"Skipping {len(links) - len(unique_links)} duplicate links.")
+        tasks = [self.process_link(link) for link in unique_links.values()]
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Every lookup in this batch shares one session, closed once the batch is done
+        async with await self._ensure_session():
+            results = await asyncio.gather(*tasks, return_exceptions=True)
 
         for result in results:
             if isinstance(result, Exception):
                 logging.error(f"Error processing link: {result}")
             else:
-                # Detect if the result indicates proxy failure and log it accordingly
-                for key, paper_data in result.items():
-                    if "error" in paper_data and "proxy failure" in paper_data.get("message", ""):
-                        failed_proxies.add(proxy)  # Add failed proxy to the blacklist
-                    all_processed_papers.update(result)
+                all_processed_papers.update(result)
 
         return all_processed_papers
 
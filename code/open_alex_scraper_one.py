@@ -1,9 +1,11 @@
-import json
+import orjson
+import ijson
 import aiohttp
 import aiofiles
 import asyncio
 import logging
 import os
+from utils import normalize_doi
 
 # Configure logging
 logging.basicConfig(filename='error_log.txt', level=logging.ERROR)
@@ -13,28 +15,53 @@ BASE_JSON_DIR = 'JSON/'
 CACHE_FILE = os.path.join(BASE_JSON_DIR, 'processed_papers.json')
 DOI_TRACKING_FILE = os.path.join(BASE_JSON_DIR, 'doi_tracking.json')
 
+# Articles processed at once, and the matching connection pool size
+MAX_CONCURRENCY = 32
+
+# Input files at least this large are parsed incrementally instead of loaded whole
+STREAM_THRESHOLD = 16 * 1024 * 1024
+
+# Time allowed for resolving a link's redirects
+REDIRECT_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+# The paper cache is written to disk after this many new entries, and once processing ends
+FLUSH_EVERY = 128
+
 doi_tracking = {}
 cache_data = []
+# Indexes over cache_data, so a cache lookup is a dict hit instead of a scan
+cache_by_doi = {}
+cache_by_url = {}
+cache_dirty = 0  # Entries added since the cache was last saved
+cache_lock = asyncio.Lock()  # One cache save at a time
 
 async def follow_redirects(session, url):
     """Follow redirects to get the final URL."""
     try:
-        async with session.get(url, allow_redirects=True) as response:
-            final_url = str(response.url)  # Get the final URL after redirects
-            return final_url
+        # HEAD fetches the headers only; the final URL is all we need
+        async with session.head(url, allow_redirects=True, max_redirects=10, timeout=REDIRECT_TIMEOUT) as response:
+            if response.status not in (405, 501):
+                return str(response.url)  # Get the final URL after redirects
+        # The server doesn't support HEAD; fall back to GET and drop the body unread
+        async with session.get(url, allow_redirects=True, max_redirects=10, timeout=REDIRECT_TIMEOUT) as response:
+            response.release()
+            return str(response.url)
     except Exception as e:
         logging.error(f"Error following URL {url}: {e}")
         return url  # Return the original URL if there's an error
 
 
 async def get_paper_metadata(session, doi=None, url=None):
-    """Fetch metadata of a paper from OpenAlex API using DOI or URL asynchronously."""
+    """
+    Fetch metadata of a paper from OpenAlex API using DOI or URL asynchronously.
+    The DOI endpoint is used whenever a DOI is given; the URL's redirects are only followed without one,
+    and the URL is kept just for the fallback metadata.
+    """
     if not any([doi, url]):
         raise ValueError("At least one of 'doi' or 'url' must be provided.")
 
     if doi:
-        # Strip the "https://doi.org/" from the DOI if it exists
-        doi = doi.replace("https://doi.org/", "")
+        doi = normalize_doi(doi)
         api_url = f"https://api.openalex.org/works/doi:{doi}"
     elif url:
         # Follow the URL to get the final URL after redirects
@@ -49,11 +76,9 @@ async def get_paper_metadata(session, doi=None, url=None):
             if response.status != 200:
                 logging.error(f"Error: Received status code {response.status} for {doi or url}.")
                 return default_paper_metadata(doi, url)
-            metadata = await response.json()
+            metadata = orjson.loads(await response.read())
 
-        doi = metadata.get("doi", None)
-        if doi:
-            doi = doi[len("https://doi.org/"):]  # Strip the DOI URL prefix
+        doi = normalize_doi(metadata["doi"]) if metadata.get("doi") else None
 
         title = metadata.get("display_name", "No Title Available")
         return {
@@ -91,13 +116,20 @@ def default_paper_metadata(doi=None, url=None):
     }
 
 
-async def process_article(article, session):
+async def process_article(article, session, sem):
     """Process each article and fetch metadata for each paperlink and DOI URL."""
+    async with sem:
+        return await _process_article(article, session)
+
+
+async def _process_article(article, session):
     processed_papers = []
 
     for paperlink_info in article.get('paperlinks', []):
         try:
             doi = paperlink_info.get('doi', None)
+            if doi and doi != 'N/A':
+                doi = normalize_doi(doi)
             url = paperlink_info.get('paperlink', None)
 
             # Check cache before making API requests
@@ -109,7 +141,7 @@ async def process_article(article, session):
                 paper_data['source_article_title'] = article['title']
 
                 # Update cache
-                update_cache(paper_data)
+                await update_cache(paper_data)
                 processed_papers.append(paper_data)
 
             # Track DOIs across articles
@@ -124,18 +156,41 @@ async def process_article(article, session):
 
 def check_cache(doi=None, url=None):
     """Check if metadata for a given DOI or URL is already in the cache."""
-    for paper in cache_data:
-        if paper['doi'] == doi or paper['doi_url'] == url:
-            return paper
-    return None
+    return cache_by_doi.get(doi) or cache_by_url.get(url)
 
 
-def update_cache(new_data):
-    """Update the cache with new metadata."""
+def index_cache_entry(paper):
+    """Add a cached paper to the DOI and URL indexes, keeping the earliest entry for each key."""
+    # Placeholder values from default_paper_metadata would match unrelated papers
+    if paper.get('doi') and paper['doi'] != 'N/A':
+        cache_by_doi.setdefault(normalize_doi(paper['doi']), paper)
+    if paper.get('doi_url') and paper['doi_url'] != 'N/A':
+        cache_by_url.setdefault(paper['doi_url'], paper)
+
+
+async def update_cache(new_data):
+    """Update the cache with new metadata, saving it every FLUSH_EVERY entries."""
+    global cache_dirty
     cache_data.append(new_data)
+    index_cache_entry(new_data)
+
+    cache_dirty += 1
+    if cache_dirty >= FLUSH_EVERY:
+        await save_cache()
+
 
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(cache_data, f, indent=4)
+async def save_cache():
+    """Save the cache to the processed_papers.json file without blocking the event loop."""
+    global cache_dirty
+    async with cache_lock:
+        # Snapshot the cache before awaiting, so entries added during the write wait for the next save
+        data = orjson.dumps(cache_data, option=orjson.OPT_INDENT_2)
+        cache_dirty = 0
+        # Write to a temporary file and swap it in, so an interrupted save never leaves a truncated cache
+        tmp_file = CACHE_FILE + '.tmp'
+        async with aiofiles.open(tmp_file, 'wb') as f:
+            await f.write(data)
+        os.replace(tmp_file, CACHE_FILE)
 
 
 def track_doi(doi, url, article_index):
@@ -153,24 +208,72 @@ def track_doi(doi, url, article_index):
         doi_tracking[doi]['indices'].append(article_index)
 
 
-async def process_all_articles(articleinfos_path, output_path):
-    """Open articleinfos.json, process each article, and save results to a new JSON file."""
-    print(f"Opening file: {articleinfos_path}")
-    async with aiofiles.open(articleinfos_path, 'r') as f:
-        articles = json.loads(await f.read())
+def article_line(article, papers):
+    """Encode one article's papers as an NDJSON line, tagged with the article index since lines arrive out of order."""
+    return orjson.dumps({"index": article.get('index'), "papers": papers}) + b"\n"
+
+
+async def stream_articles(articleinfos_path, session, sem, out):
+    """Process articles as they are parsed from the file, keeping only a bounded queue of them in memory."""
+    queue = asyncio.Queue(maxsize=MAX_CONCURRENCY * 2)
 
+    async def worker():
+        while True:
+            position, article = await queue.get()
+            try:
+                papers = await process_article(article, session, sem)
+            except Exception as e:
+                logging.error(f"Error processing article {position}: {e}")
+                papers = []
+            try:
+                await out.write(article_line(article, papers))
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(MAX_CONCURRENCY)]
+    try:
+        async with aiofiles.open(articleinfos_path, 'rb') as f:
+            position = 0
+            async for article in ijson.items(f, 'item', use_float=True):
+                await queue.put((position, article))
+                position += 1
+        await queue.join()
+    finally:
+        for worker_task in workers:
+            worker_task.cancel()
+
+
+async def process_all_articles(articleinfos_path, output_path):
+    """Open articleinfos.json, process each article, and write the results to an NDJSON file as they complete."""
     # Load the cache data from processed_papers.json
     load_cache()
 
     print("Setting up session...")
-    async with aiohttp.ClientSession() as session:
-        tasks = [process_article(article, session) for article in articles]
-        print("Processing articles...")
-        all_papers = await asyncio.gather(*tasks)
-
-    print(f"Saving processed papers to: {output_path}")
-    async with aiofiles.open(output_path, 'w') as f:
-        await f.write(json.dumps(all_papers, indent=4))
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MAX_CONCURRENCY)) as session, \
+                aiofiles.open(output_path, 'wb') as out:
+            print(f"Opening file: {articleinfos_path}")
+            print(f"Writing processed papers to: {output_path}")
+            if os.path.getsize(articleinfos_path) >= STREAM_THRESHOLD:
+                print("Processing articles...")
+                await stream_articles(articleinfos_path, session, sem, out)
+            else:
+                async with aiofiles.open(articleinfos_path, 'rb') as f:
+                    articles = orjson.loads(await f.read())
+
+                async def process(article):
+                    return article, await process_article(article, session, sem)
+
+                print("Processing articles...")
+                # Write each article's papers as soon as they are ready, overlapping disk writes with the API calls
+                for coro in asyncio.as_completed([process(article) for article in articles]):
+                    article, papers = await coro
+                    await out.write(article_line(article, papers))
+    finally:
+        # Save whatever was fetched, even if processing was interrupted
+        if cache_dirty:
+            await save_cache()
 
     print("Processing complete.")
 
@@ -182,28 +285,40 @@ def load_cache():
     """Load cache from the processed_papers.json file."""
     global cache_data
     if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, 'r') as f:
+        with open(CACHE_FILE, 'rb') as f:
             try:
-                cache_data = json.load(f)
-            except json.JSONDecodeError:
+                cache_data = orjson.loads(f.read())
+            except orjson.JSONDecodeError:
                 cache_data = []
+    cache_by_doi.clear()
+    cache_by_url.clear()
+    for paper in cache_data:
+        index_cache_entry(paper)
 
 
 def save_doi_tracking():
     """Save the DOI tracking information to a file."""
     os.makedirs(os.path.dirname(DOI_TRACKING_FILE), exist_ok=True)
 
-    with open(DOI_TRACKING_FILE, 'w') as f:
-        json.dump(doi_tracking, f, indent=4)
+    with open(DOI_TRACKING_FILE, 'wb') as f:
+        # Paperlinks without a DOI are tracked under None, which json wrote as "null"
+        f.write(orjson.dumps(doi_tracking, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
     print(f"DOI tracking saved to {DOI_TRACKING_FILE}")
 
 
 # Example usage
 if __name__ == '__main__':
+    # Use uvloop's faster event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     # File paths within the JSON directory
     articleinfos_path = os.path.join(BASE_JSON_DIR, 'urldictcleandoistwo.json')
-    output_path = os.path.join(BASE_JSON_DIR, 'processed_papers_two.json')
+    output_path = os.path.join(BASE_JSON_DIR, 'processed_papers_two.ndjson')
 
     # Run the processing
     asyncio.run(process_all_articles(articleinfos_path, output_path))
@@ -1,12 +1,18 @@
-import json
+import orjson
 import aiohttp
+import ijson
 import aiofiles
 import asyncio
-from urllib.parse import urlparse, urlunparse
+import random
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
 import logging
 from tqdm.asyncio import tqdm
-from aiohttp_client_cache import CachedSession, SQLiteBackend
+from aiohttp_client_cache import CachedSession
+from aiolimiter import AsyncLimiter
+from utils import TunedSQLiteBackend
 from datetime import timedelta
+from types import MappingProxyType
 
 # Configure logging
 logging.basicConfig(filename='error_log.txt', level=logging.ERROR)
@@ -18,40 +24,83 @@ urls_expire_after = {
  # Requests for this pattern will never expire
 }
 
+# Requests in flight at once, and OpenAlex's documented cap of 10 requests per second
+SEM = asyncio.Semaphore(10)
+OPENALEX_LIMITER = AsyncLimiter(10, 1)
+
+# Metadata reported when a paper can't be found or fetched. Read-only; callers get their own copy.
+NA_METADATA = MappingProxyType({
+    "title": "N/A",
+    "first_author": "N/A",
+    "authors": "N/A",
+    "year": "N/A",
+    "doi": "N/A",
+    "doi_url": "N/A",
+    "journal_or_institution": "N/A",
+    "pages": "N/A",
+    "volume": "N/A",
+    "number": "N/A"
+})
+
+# Attempts per OpenAlex request; rate limiting (429), server errors and connection failures are retried
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.2  # Seconds before the first retry, doubling each attempt
+RETRY_BACKOFF_MAX = 2
+
+# Articles being processed at once; the input is parsed only as fast as these finish
+MAX_ARTICLES_IN_FLIGHT = 64
+
 async def follow_redirects(session, url):
     """Follow redirects to get the final URL."""
     try:
-        async with session.get(url, allow_redirects=True) as response:
+        async with SEM, session.get(url, allow_redirects=True) as response:
             final_url = str(response.url)  # Get the final URL after redirects
             return final_url
     except Exception as e:
         logging.error(f"Error following URL {url}: {e}")
         return url  # Return the original URL if there's an error
 
+@lru_cache(maxsize=1 << 16)
 def clean_url(url):
-    """Clean the URL by removing query parameters, fragments, and specific cases with urllib and custom logic."""
+    """Clean the URL by removing query parameters, fragments, and specific cases; cached because links recur across articles."""
     # Handle specific case for psycnet
     if url.startswith("https://psycnet.apa.org/doiLanding?doi="):
-        return url.split('=')[-1]  # Extract DOI part
+        return url.rsplit('=', 1)[-1]  # Extract DOI part
 
     # Remove "/full" or "/abstract" from the URL path
-    url = url.split('/full')[0]
-    url = url.split('/abstract')[0]
-
-    # Parse the URL into components
-    parsed_url = urlparse(url)
+    url = url.partition('/full')[0].partition('/abstract')[0]
 
-    # Rebuild the URL without the query and fragment parts
-    cleaned_url = urlunparse((
-        parsed_url.scheme,  # Keep scheme (e.g., https)
-        parsed_url.netloc,  # Keep domain (e.g., www.example.com)
-        parsed_url.path,  # Keep the path (but without /full or /abstract)
-        parsed_url.params,  # Keep URL parameters (if any)
-        '',  # Remove query parameters (anything after '?')
-        ''  # Remove fragments (anything after '#')
-    ))
+    # Keep the scheme, domain and path, dropping the query and fragment
+    parsed_url = urlsplit(url)
+    if parsed_url.scheme and parsed_url.netloc:
+        return f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
+    return urlunsplit((parsed_url.scheme, parsed_url.netloc, parsed_url.path, '', ''))
 
-    return cleaned_url
+async def fetch_work(session, api_url, label):
+    """
+    GET an OpenAlex API URL, retrying transient failures with exponential backoff.
+    Returns (status, decoded body); the body is None unless status is 200, and status is None
+    if every attempt failed to connect.
+    """
+    status = None
+    for attempt in range(MAX_RETRIES):
+        if attempt:
+            # Exponential backoff with jitter before each retry
+            await asyncio.sleep(min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX) + random.random() * RETRY_BACKOFF)
+        try:
+            async with SEM, OPENALEX_LIMITER, session.get(api_url) as response:
+                status = response.status
+                if status == 429 or status >= 500:
+                    logging.error(f"Error: Received status code {status} for {label}, attempt {attempt + 1} of {MAX_RETRIES}.")
+                    continue
+                if status != 200:
+                    # Other 4xx responses won't change on a retry
+                    return status, None
+                return status, orjson.loads(await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = None
+            logging.error(f"Error fetching metadata for {label}, attempt {attempt + 1} of {MAX_RETRIES}: {e}")
+    return status, None
 
 async def get_paper_metadata(session, doi=None, url=None):
     """Fetch metadata of a paper from OpenAlex API using DOI or URL asynchronously."""
@@ -60,91 +109,105 @@ async def get_paper_metadata(session, doi=None, url=None):
 
     if doi:
         # Strip the "https://doi.org/" from the DOI if it exists
-        doi = doi.replace("https://doi.org/", "")
+        doi = doi.removeprefix("https://doi.org/")
         api_url = f"https://api.openalex.org/works/doi:{doi}"
     elif url:
-        # Follow the URL to get the final URL after redirects
-        final_url = await follow_redirects(session, url)
-        final_url = clean_url(final_url)  # Clean the final URL
-        api_url = f"https://api.openalex.org/works/{final_url}"
+        # OpenAlex resolves most landing-page URLs itself, so try the URL as given first.
+        # URLs are cleaned here, once per lookup, rather than in a pass over every article up front.
+        cleaned_url = clean_url(url)
+        api_url = f"https://api.openalex.org/works/{cleaned_url}"
 
     try:
-        async with session.get(api_url) as response:
-            if response.status == 404:
-                logging.error(f"Error: Received status code 404 for {doi or url}. Resource not found.")
-                return {
-                    "title": "N/A",
-                    "first_author": "N/A",
-                    "authors": "N/A",
-                    "year": "N/A",
-                    "doi": "N/A",
-                    "doi_url": "N/A",
-                    "journal_or_institution": "N/A",
-                    "pages": "N/A",
-                    "volume": "N/A",
-                    "number": "N/A"
-                }
-            if response.status != 200:
-                logging.error(f"Error: Received status code {response.status} for {doi or url}.")
-                return {
-                    "title": "N/A",
-                    "first_author": "N/A",
-                    "authors": "N/A",
-                    "year": "N/A",
-                    "doi": "N/A",
-                    "doi_url": "N/A",
-                    "journal_or_institution": "N/A",
-                    "pages": "N/A",
-                    "volume": "N/A",
-                    "number": "N/A"
-                }
-            metadata = await response.json()
+        status, metadata = await fetch_work(session, api_url, doi or url)
+        if status == 404 and not doi:
+            # Not found as given: follow the URL's redirects and try the final URL instead
+            final_url = clean_url(await follow_redirects(session, url))
+            if final_url != cleaned_url:
+                status, metadata = await fetch_work(session, f"https://api.openalex.org/works/{final_url}", url)
+        if status is None:
+            logging.error(f"Error fetching metadata for {doi or url} after {MAX_RETRIES} attempts.")
+            return dict(NA_METADATA)
+        if status == 404:
+            logging.error(f"Error: Received status code 404 for {doi or url}. Resource not found.")
+            return dict(NA_METADATA)
+        if status != 200:
+            logging.error(f"Error: Received status code {status} for {doi or url}.")
+            return dict(NA_METADATA)
 
         # Extract metadata for DOI and title
         doi = metadata.get("doi", None)
         if doi:
-            doi = doi[len("https://doi.org/"):]  # Strip the DOI URL prefix
+            doi = doi.removeprefix("https://doi.org/")  # Strip the DOI URL prefix
         title = metadata.get("display_name", "No Title Available")
 
+        # Walk the authorships and biblio once each
+        names = [authorship["author"]["display_name"] for authorship in metadata.get("authorships") or ()]
+        biblio = metadata.get("biblio") or {}
+
         return {
             "title": title,
-            "first_author": metadata["authorships"][0]["author"]["display_name"] if metadata.get(
-                "authorships") else "N/A",
-            "authors": ", ".join([author["author"]["display_name"] for author in metadata.get("authorships", [])]) or "N/A",
+            "first_author": names[0] if names else "N/A",
+            "authors": ", ".join(names) or "N/A",
             "year": metadata.get("publication_year", "N/A"),
             "doi": doi if doi else "N/A",
             "doi_url": metadata.get("doi", "N/A"),
             "journal_or_institution": metadata.get("host_venue", {}).get("display_name", "N/A"),
-            "pages": f"{metadata['biblio'].get('first_page', 'N/A')}-{metadata['biblio'].get('last_page', 'N/A')}",
-            "volume": metadata["biblio"].get("volume", "N/A"),
-            "number": metadata["biblio"].get("issue", "N/A")
+            "pages": f"{biblio.get('first_page', 'N/A')}-{biblio.get('last_page', 'N/A')}",
+            "volume": biblio.get("volume", "N/A"),
+            "number": biblio.get("issue", "N/A")
         }
     except Exception as e:
         logging.error(f"Error fetching metadata for {doi or url}: {e}")
-        return {
-            "title": "N/A",
-            "first_author": "N/A",
-            "authors": "N/A",
-            "year": "N/A",
-            "doi": "N/A",
-            "doi_url": "N/A",
-            "journal_or_institution": "N/A",
-            "pages": "N/A",
-            "volume": "N/A",
-            "number": "N/A"
-        }
+        return dict(NA_METADATA)
 
-async def process_article(article, session):
-    """Process each article and fetch metadata for each paperlink and DOI URL."""
+async def get_doi_url_metadata(session, doi_url):
+    """Follow a DOI URL and fetch metadata for the DOI it resolves to."""
+    final_url = await follow_redirects(session, doi_url)
+    doi = final_url.split('/')[-1]  # Extract DOI from URL
+    return await get_paper_metadata(session, doi=doi)
+
+def start_paper_tasks(articles, session, paper_tasks=None):
+    """
+    Start one metadata lookup per distinct paperlink and DOI URL across all articles, keyed by (type, key).
+    Pass the dict returned by an earlier call as paper_tasks to share lookups with the articles seen before.
+    """
+    if paper_tasks is None:
+        paper_tasks = {}
+    for article in articles:
+        for paperlink_info in article.get('paperlinks', []):
+            key = ('paperlink', (paperlink_info.get('doi', None), paperlink_info.get('paperlink', None)))
+            if key not in paper_tasks:
+                doi, url = key[1]
+                paper_tasks[key] = asyncio.create_task(get_paper_metadata(session, doi=doi, url=url))
+        for doi_url in article.get('doi_urls', []):
+            key = ('doi_url', doi_url)
+            if key not in paper_tasks:
+                paper_tasks[key] = asyncio.create_task(get_doi_url_metadata(session, doi_url))
+    return paper_tasks
+
+async def process_article(article, paper_tasks):
+    """Collect the metadata for each paperlink and DOI URL of an article from the shared lookups."""
     processed_papers = []
+    paperlinks = article.get('paperlinks', [])
+    doi_urls = article.get('doi_urls', [])
+
+    # Wait on all of the article's lookups together, so its latency is the slowest link rather than their sum
+    results = await asyncio.gather(
+        *(paper_tasks[('paperlink', (info.get('doi', None), info.get('paperlink', None)))] for info in paperlinks),
+        *(paper_tasks[('doi_url', doi_url)] for doi_url in doi_urls),
+        return_exceptions=True
+    )
 
     # Process paper links
-    for paperlink_info in article.get('paperlinks', []):
+    for paperlink_info, paper_data in zip(paperlinks, results):
+        doi = paperlink_info.get('doi', None)
+        url = paperlink_info.get('paperlink', None)
         try:
-            doi = paperlink_info.get('doi', None)
-            url = paperlink_info.get('paperlink', None)
+            if isinstance(paper_data, Exception):
+                raise paper_data
 
-            paper_data = await get_paper_metadata(session, doi=doi, url=url)
+            # Copy the shared result before tagging it with this article
+            paper_data = dict(paper_data)
             paper_data['source_article_title'] = article['title']
 
             processed_papers.append(paper_data)
@@ -168,11 +231,12 @@ async def process_article(article, session):
             })
 
     # Process DOI URLs
-    for doi_url in article.get('doi_urls', []):
+    for doi_url, paper_data in zip(doi_urls, results[len(paperlinks):]):
         try:
-            final_url = await follow_redirects(session, doi_url)
-            doi = final_url.split('/')[-1]  # Extract DOI from URL
-            paper_data = await get_paper_metadata(session, doi=doi)
+            if isinstance(paper_data, Exception):
+                raise paper_data
+
+            paper_data = dict(paper_data)
             paper_data['source_article_title'] = article['title']
             paper_data['doi_url'] = doi_url
 
@@ -198,44 +262,63 @@ async def process_article(article, session):
 
     return processed_papers
 
-async def clean_urls_in_article(articles):
-    """Clean the URLs for all articles in the given list."""
-    for article in articles:
-        cleaned_paperlinks = [clean_url(link['paperlink']) for link in article.get('paperlinks', [])]
-        for idx, link in enumerate(article['paperlinks']):
-            link['paperlink'] = cleaned_paperlinks[idx]
+def article_line(article, papers):
+    """Encode one article's papers as an NDJSON line, tagged with the article index since lines arrive out of order."""
+    return orjson.dumps({"index": article.get('index'), "papers": papers}) + b"\n"
 
 async def process_all_articles(articleinfos_path, output_path):
-    """Open articleinfos.json, clean URLs, process each article, and save results to a new JSON file."""
-    print(f"Opening file: {articleinfos_path}")
-    async with aiofiles.open(articleinfos_path, 'r') as f:
-        articles = json.loads(await f.read())
-
-    # Clean URLs in articles
-    print("Cleaning URLs in articles...")
-    await clean_urls_in_article(articles)
-
+    """
+    Stream articles from articleinfos.json, process them, and write each article's papers
+    to an NDJSON file as soon as it completes. Only a bounded queue of articles is held in memory.
+    """
     # Setup caching and session
     print("Setting up cache and session...")
-    cache_backend = SQLiteBackend('cache.db', expire_after=default_expire_after)
-    async with CachedSession(cache=cache_backend, expire_after=default_expire_after) as session:
-        tasks = [process_article(article, session) for article in articles]
-        print("Processing articles...")
-        all_papers = await asyncio.gather(*tasks)
+    cache_backend = TunedSQLiteBackend('cache.db', expire_after=default_expire_after)
+    async with CachedSession(cache=cache_backend, expire_after=default_expire_after) as session, \
+            aiofiles.open(output_path, 'wb') as out:
+        # Articles citing the same paper share one request instead of each fetching it
+        paper_tasks = {}
+        queue = asyncio.Queue(maxsize=MAX_ARTICLES_IN_FLIGHT)
+
+        async def worker():
+            while True:
+                article = await queue.get()
+                try:
+                    await out.write(article_line(article, await process_article(article, paper_tasks)))
+                except Exception as e:
+                    logging.error(f"Error processing article {article.get('index')}: {e}")
+                finally:
+                    queue.task_done()
 
-    # Save processed papers to output file
-    print(f"Saving processed papers to: {output_path}")
-    async with aiofiles.open(output_path, 'w') as f:
-        await f.write(json.dumps(all_papers, indent=4))
+        workers = [asyncio.create_task(worker()) for _ in range(MAX_ARTICLES_IN_FLIGHT)]
+        try:
+            print(f"Opening file: {articleinfos_path}")
+            print(f"Writing processed papers to: {output_path}")
+            print("Processing articles...")
+            async with aiofiles.open(articleinfos_path, 'rb') as f:
+                async for article in ijson.items(f, 'item', use_float=True):
+                    start_paper_tasks([article], session, paper_tasks)
+                    await queue.put(article)
+            await queue.join()
+        finally:
+            for worker_task in workers:
+                worker_task.cancel()
 
     print("Processing complete.")
 
 
 # Example usage
 if __name__ == '__main__':
+    # Use uvloop's faster event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     # File paths
     articleinfos_path = 'urldictcleandoistwo.json'
-    output_path = 'processed_papers_two.json'
+    output_path = 'processed_papers_two.ndjson'
 
     # Run the processing
     asyncio.run(process_all_articles(articleinfos_path, output_path))
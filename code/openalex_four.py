@@ -1,81 +1,121 @@
-import json
+import orjson
 import aiohttp
-import aiofiles
+from pathlib import Path
 import asyncio
-from urllib.parse import urlparse, urlunparse
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
 import logging
 from tqdm.asyncio import tqdm
+from aiohttp_client_cache import CachedSession
+from aiolimiter import AsyncLimiter
+from utils import TunedSQLiteBackend
 
 # Configure logging
 logging.basicConfig(filename='error_log.txt', level=logging.ERROR)
 
-async def follow_redirects(url):
-    """Follow redirects to get the final URL."""
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, allow_redirects=True) as response:
-                final_url = str(response.url)  # Get the final URL after redirects
-                return final_url
-        except Exception as e:
-            logging.error(f"Error following URL {url}: {e}")
-            return url  # Return the original URL if there's an error
+# Caching configuration
+default_expire_after = 60 * 60  # Default cache expiration time: 1 hour
 
-async def get_paper_metadata(doi=None, url=None):
+# Requests in flight at once, and OpenAlex's documented cap of 10 requests per second
+SEM = asyncio.Semaphore(10)
+OPENALEX_LIMITER = AsyncLimiter(10, 1)
+
+async def follow_redirects(session, url):
+    """Follow redirects to get the final URL."""
+    try:
+        async with SEM, session.get(url, allow_redirects=True) as response:
+            final_url = str(response.url)  # Get the final URL after redirects
+            return final_url
+    except Exception as e:
+        logging.error(f"Error following URL {url}: {e}")
+        return url  # Return the original URL if there's an error
+
+@lru_cache(maxsize=1 << 16)
+def clean_url(url):
+    """Clean the URL by removing query parameters, fragments, and specific cases; cached because links recur across articles."""
+    # Handle specific case for psycnet
+    if url.startswith("https://psycnet.apa.org/doiLanding?doi="):
+        return url.rsplit('=', 1)[-1]  # Extract DOI part
+
+    # Remove "/full" or "/abstract" from the URL path
+    url = url.partition('/full')[0].partition('/abstract')[0]
+
+    # Keep the scheme, domain and path, dropping the query and fragment
+    parsed_url = urlsplit(url)
+    if parsed_url.scheme and parsed_url.netloc:
+        return f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
+    return urlunsplit((parsed_url.scheme, parsed_url.netloc, parsed_url.path, '', ''))
+
+async def get_paper_metadata(session, doi=None, url=None):
     """Fetch metadata of a paper from OpenAlex API using DOI or URL asynchronously."""
     if not any([doi, url]):
         raise ValueError("At least one of 'doi' or 'url' must be provided.")
 
-    async with aiohttp.ClientSession() as session:
-        if doi:
-            # Strip the "https://doi.org/" from the DOI if it exists
-            doi = doi.replace("https://doi.org/", "")
-            api_url = f"https://api.openalex.org/works/doi:{doi}"
-        elif url:
-            # Follow the URL to get the final URL after redirects
-            final_url = await follow_redirects(url)
-            final_url = clean_url(final_url)  # Clean the final URL
-            api_url = f"https://api.openalex.org/works/{final_url}"
-
-        async with session.get(api_url) as response:
-            if response.status == 404:
-                logging.error(f"Error: Received status code 404 for {doi or url}. Resource not found.")
-                return {"error": f"Could not find metadata for {doi or url}"}
-            if response.status != 200:
-                logging.error(f"Error: Received status code {response.status} for {doi or url}.")
-                return {"error": f"Error: Received status code {response.status} for {doi or url}"}
-            metadata = await response.json()
+    if doi:
+        # Strip the "https://doi.org/" from the DOI if it exists
+        doi = doi.removeprefix("https://doi.org/")
+        api_url = f"https://api.openalex.org/works/doi:{doi}"
+    elif url:
+        # Follow the URL to get the final URL after redirects
+        final_url = await follow_redirects(session, url)
+        final_url = clean_url(final_url)  # Clean the final URL
+        api_url = f"https://api.openalex.org/works/{final_url}"
+
+    async with SEM, OPENALEX_LIMITER, session.get(api_url) as response:
+        if response.status == 404:
+            logging.error(f"Error: Received status code 404 for {doi or url}. Resource not found.")
+            return {"error": f"Could not find metadata for {doi or url}"}
+        if response.status != 200:
+            logging.error(f"Error: Received status code {response.status} for {doi or url}.")
+            return {"error": f"Error: Received status code {response.status} for {doi or url}"}
+        metadata = orjson.loads(await response.read())
 
     # Extract metadata for DOI and title
     doi = metadata.get("doi", None)
     if doi:
-        doi = doi[len("https://doi.org/"):]  # Strip the DOI URL prefix
+        doi = doi.removeprefix("https://doi.org/")  # Strip the DOI URL prefix
     title = metadata.get("display_name", "No Title Available")
 
+    # Walk the authorships and biblio once each
+    names = [authorship["author"]["display_name"] for authorship in metadata.get("authorships") or ()]
+    biblio = metadata.get("biblio") or {}
+
     return {
         "title": title,
-        "first_author": metadata["authorships"][0]["author"]["display_name"] if metadata.get(
-            "authorships") else "No Author",
-        "authors": ", ".join([author["author"]["display_name"] for author in metadata.get("authorships", [])]),
+        "first_author": names[0] if names else "No Author",
+        "authors": ", ".join(names),
         "year": metadata.get("publication_year", "Unknown Year"),
         "doi": doi,
         "doi_url": metadata.get("doi", "No DOI available"),
         "journal_or_institution": metadata.get("host_venue", {}).get("display_name", "Unknown Institution"),
-        "pages": f"{metadata['biblio'].get('first_page', '')}-{metadata['biblio'].get('last_page', '')}",
-        "volume": metadata["biblio"].get("volume", ""),
-        "number": metadata["biblio"].get("issue", "")
+        "pages": f"{biblio.get('first_page', '')}-{biblio.get('last_page', '')}",
+        "volume": biblio.get("volume", ""),
+        "number": biblio.get("issue", "")
     }
 
 
 
-async def process_article(article):
-    """Process each article and fetch metadata for each paperlink."""
+def start_paper_tasks(articles, session):
+    """Start one metadata lookup per distinct (doi, paperlink) pair across all articles."""
+    paper_tasks = {}
+    for article in articles:
+        for paperlink_info in article['paperlinks']:
+            key = (paperlink_info.get('doi', None), paperlink_info.get('paperlink', None))
+            if key not in paper_tasks:
+                doi, url = key
+                paper_tasks[key] = asyncio.create_task(get_paper_metadata(session, doi=doi, url=url))
+    return paper_tasks
+
+async def process_article(article, paper_tasks):
+    """Collect the metadata for each paperlink of an article from the shared lookups."""
     processed_papers = []
     for paperlink_info in article['paperlinks']:
         try:
             doi = paperlink_info.get('doi', None)
             url = paperlink_info.get('paperlink', None)
 
-            paper_data = await get_paper_metadata(doi=doi, url=url)
+            # Copy the shared result before tagging it with this article
+            paper_data = dict(await paper_tasks[(doi, url)])
 
             paper_data['source_article_title'] = article['title']
 
@@ -93,34 +133,54 @@ async def process_article(article):
             })
     return processed_papers
 
-async def clean_urls_in_article(articles):
+def clean_urls_in_article(articles):
     """Clean the URLs for all articles in the given list."""
     for article in articles:
-        cleaned_paperlinks = [clean_url(link['paperlink']) for link in article.get('paperlinks', [])]
-        for idx, link in enumerate(article['paperlinks']):
-            link['paperlink'] = cleaned_paperlinks[idx]
+        for link in article.get('paperlinks', []):
+            link['paperlink'] = clean_url(link['paperlink'])
 
 async def process_all_articles(articleinfos_path, output_path):
     """Open articleinfos.json, clean URLs, process each article, and save results to a new JSON file."""
-    async with aiofiles.open(articleinfos_path, 'r') as f:
-        content = await f.read()
-        articles = json.loads(content)
+    # Read the whole file in one thread hop and parse it with orjson
+    articles = orjson.loads(await asyncio.to_thread(Path(articleinfos_path).read_bytes))
 
-    await clean_urls_in_article(articles)
+    clean_urls_in_article(articles)
 
     all_processed_papers = []
 
-    total_articles = len(articles)
-    with tqdm(total=total_articles, desc="Processing articles") as pbar:
-        for article in articles:
-            processed_papers = await process_article(article)
-            all_processed_papers.extend(processed_papers)
-            pbar.update(1)
-
-    async with aiofiles.open(output_path, 'w') as f:
-        await f.write(json.dumps(all_processed_papers, indent=4))
+    # One session for every request, so connections are kept alive and reused across articles
+    cache_backend = TunedSQLiteBackend('cache.db', expire_after=default_expire_after)
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=10, ttl_dns_cache=300)
+    async with CachedSession(cache=cache_backend, connector=connector) as session:
+        total_articles = len(articles)
+        with tqdm(total=total_articles, desc="Processing articles") as pbar:
+            # Process the articles concurrently, ticking the progress bar as each one finishes
+            # Articles citing the same paper share one request instead of each fetching it
+            paper_tasks = start_paper_tasks(articles, session)
+            tasks = [asyncio.create_task(process_article(article, paper_tasks)) for article in articles]
+            for task in tasks:
+                task.add_done_callback(lambda _: pbar.update(1))
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # gather keeps the input order, so papers stay grouped by article as before
+    for article, processed_papers in zip(articles, results):
+        if isinstance(processed_papers, Exception):
+            logging.error(f"Error processing article {article.get('title')}: {processed_papers}")
+            continue
+        all_processed_papers.extend(processed_papers)
+
+    # Compact output; the file is read by scripts, not people
+    blob = orjson.dumps(all_processed_papers)
+    await asyncio.to_thread(Path(output_path).write_bytes, blob)
 
     print(f"Paper metadata saved to {output_path}")
 
 if __name__ == "__main__":
+    # Use uvloop's faster event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     asyncio.run(process_all_articles('urldictcleandoistwo.json', 'processed_papers_two.json'))
@@ -1,93 +1,101 @@
-import json
+import orjson
 import aiohttp
-import aiofiles
+from pathlib import Path
 import asyncio
-from urllib.parse import urlparse, urlunparse
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit
 import logging
+from aiolimiter import AsyncLimiter
 
 # Configure logging
 logging.basicConfig(filename='error_log.txt', level=logging.ERROR)
 
+# Requests in flight at once, and OpenAlex's documented cap of 10 requests per second
+SEM = asyncio.Semaphore(10)
+OPENALEX_LIMITER = AsyncLimiter(10, 1)
 
-async def get_paper_metadata(doi=None, url=None):
+
+async def get_paper_metadata(session, doi=None, url=None):
     """Fetch metadata of a paper from OpenAlex API using DOI or URL asynchronously."""
     if not any([doi, url]):
         raise ValueError("At least one of 'doi' or 'url' must be provided.")
 
-    async with aiohttp.ClientSession() as session:
-        if doi:
-            # Strip the "https://doi.org/" from the DOI if it exists
-            doi = doi.replace("https://doi.org/", "")
-            api_url = f"https://api.openalex.org/works/doi:{doi}"
-        elif url:
-            url = clean_url(url)  # Clean the URL by removing query parameters and fragments
-            api_url = f"https://api.openalex.org/works/{url}"
-
-        async with session.get(api_url) as response:
-            if response.status == 404:
-                logging.error(f"Error: Received status code 404 for {url}. Resource not found.")
-                raise Exception(f"Error: Received status code 404 for {doi or url}.")
-            if response.status != 200:
-                logging.error(f"Error: Received status code {response.status} for {url}.")
-                raise Exception(f"Error: Received status code {response.status} for {doi or url}.")
-            metadata = await response.json()
+    if doi:
+        # Strip the "https://doi.org/" from the DOI if it exists
+        doi = doi.removeprefix("https://doi.org/")
+        api_url = f"https://api.openalex.org/works/doi:{doi}"
+    elif url:
+        url = clean_url(url)  # Clean the URL by removing query parameters and fragments
+        api_url = f"https://api.openalex.org/works/{url}"
+
+    async with SEM, OPENALEX_LIMITER, session.get(api_url) as response:
+        if response.status == 404:
+            logging.error(f"Error: Received status code 404 for {url}. Resource not found.")
+            raise Exception(f"Error: Received status code 404 for {doi or url}.")
+        if response.status != 200:
+            logging.error(f"Error: Received status code {response.status} for {url}.")
+            raise Exception(f"Error: Received status code {response.status} for {doi or url}.")
+        metadata = orjson.loads(await response.read())
 
     # Extract metadata for DOI and title
     doi = metadata.get("doi", None)
     if doi:
-        doi = doi[len("https://doi.org/"):]  # Strip the DOI URL prefix
+        doi = doi.removeprefix("https://doi.org/")  # Strip the DOI URL prefix
     title = metadata.get("display_name", "No Title Available")
 
     print(f"Found paper: {title}")
+    # Walk the authorships and biblio once each
+    names = [authorship["author"]["display_name"] for authorship in metadata.get("authorships") or ()]
+    biblio = metadata.get("biblio") or {}
+
     return {
-        "title": metadata.get("display_name", "No Title Available"),
-        "first_author": metadata["authorships"][0]["author"]["display_name"] if metadata.get(
-            "authorships") else "No Author",
-        "authors": ", ".join([author["author"]["display_name"] for author in metadata.get("authorships", [])]),
+        "title": title,
+        "first_author": names[0] if names else "No Author",
+        "authors": ", ".join(names),
         "year": metadata.get("publication_year", "Unknown Year"),
         "doi": doi,
         "doi_url": metadata.get("doi", "No DOI available"),
         "journal_or_institution": metadata.get("host_venue", {}).get("display_name", "Unknown Institution"),
-        "pages": f"{metadata['biblio'].get('first_page', '')}-{metadata['biblio'].get('last_page', '')}",
-        "volume": metadata["biblio"].get("volume", ""),
-        "number": metadata["biblio"].get("issue", "")
+        "pages": f"{biblio.get('first_page', '')}-{biblio.get('last_page', '')}",
+        "volume": biblio.get("volume", ""),
+        "number": biblio.get("issue", "")
     }
 
 
+@lru_cache(maxsize=1 << 16)
 def clean_url(url):
-    """Clean the URL by removing query parameters, fragments, and specific cases with urllib and custom logic."""
-
+    """Clean the URL by removing query parameters, fragments, and specific cases; cached because links recur across articles."""
     # Handle specific case for psycnet
     if url.startswith("https://psycnet.apa.org/doiLanding?doi="):
-        return url.split('=')[-1]  # Extract DOI part
+        return url.rsplit('=', 1)[-1]  # Extract DOI part
 
     # Remove "/full" or "/abstract" from the URL path
-    url = url.split('/full')[0]
-    url = url.split('/abstract')[0]
+    url = url.partition('/full')[0].partition('/abstract')[0]
 
-    # Parse the URL into components
-    parsed_url = urlparse(url)
+    # Keep the scheme, domain and path, dropping the query and fragment
+    parsed_url = urlsplit(url)
+    if parsed_url.scheme and parsed_url.netloc:
+        return f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
+    return urlunsplit((parsed_url.scheme, parsed_url.netloc, parsed_url.path, '', ''))
 
-    # Rebuild the URL without the query and fragment parts
-    cleaned_url = urlunparse((
-        parsed_url.scheme,  # Keep scheme (e.g., https)
-        parsed_url.netloc,  # Keep domain (e.g., www.example.com)
-        parsed_url.path,  # Keep the path (but without /full or /abstract)
-        parsed_url.params,  # Keep URL parameters (if any)
-        '',  # Remove query parameters (anything after '?')
-        ''  # Remove fragments (anything after '#')
-    ))
 
-    return cleaned_url
+def start_paper_tasks(articles, session):
+    """Start one metadata lookup per distinct paperlink across all articles."""
+    paper_tasks = {}
+    for article in articles:
+        for paperlink in article['paperlinks']:
+            if paperlink not in paper_tasks:
+                paper_tasks[paperlink] = asyncio.create_task(get_paper_metadata(session, url=paperlink))
+    return paper_tasks
 
 
-async def process_article(article):
-    """Process each article and fetch metadata for each paperlink."""
+async def process_article(article, paper_tasks):
+    """Collect the metadata for each paperlink of an article from the shared lookups."""
     processed_papers = []
     for paperlink in article['paperlinks']:
         try:
-            # Extract DOI from the paperlink and fetch metadata
-            paper_data = await get_paper_metadata(url=paperlink)
+            # Copy the shared result before tagging it with this article
+            paper_data = dict(await paper_tasks[paperlink])
             paper_data['source_article_title'] = article['title']
             processed_papers.append(paper_data)
         except Exception as e:
@@ -108,28 +116,43 @@ async def clean_urls_in_article(articles):
 
 async def process_all_articles(articleinfos_path, output_path):
     """Open articleinfos.json, clean URLs, process each article, and save results to a new JSON file."""
-    # Open and load articleinfos.json using aiofiles
-    async with aiofiles.open(articleinfos_path, 'r') as f:
-        content = await f.read()
-        articles = json.loads(content)
+    # Read the whole file in one thread hop and parse it with orjson
+    articles = orjson.loads(await asyncio.to_thread(Path(articleinfos_path).read_bytes))
 
     # Clean the URLs in the articles before processing
     await clean_urls_in_article(articles)
 
     all_processed_papers = []
 
-    # Process each article
-    for article in articles:
-        processed_papers = await process_article(article)
+    # One session for every request, so connections are kept alive and reused across articles
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=10, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # Articles citing the same paper share one request instead of each fetching it
+        paper_tasks = start_paper_tasks(articles, session)
+
+        # Process the articles concurrently; gather keeps the results in article order
+        results = await asyncio.gather(*(process_article(article, paper_tasks) for article in articles), return_exceptions=True)
+    for article, processed_papers in zip(articles, results):
+        if isinstance(processed_papers, Exception):
+            logging.error(f"Error processing article {article.get('title')}: {processed_papers}")
+            continue
         all_processed_papers.extend(processed_papers)
 
-    # Save the result to a new JSON file using aiofiles
-    async with aiofiles.open(output_path, 'w') as f:
-        await f.write(json.dumps(all_processed_papers, indent=4))
+    # Save the result to a new JSON file
+    # Compact output; the file is read by scripts, not people
+    blob = orjson.dumps(all_processed_papers)
+    await asyncio.to_thread(Path(output_path).write_bytes, blob)
 
     print(f"Paper metadata saved to {output_path}")
 
 
 # Run the main function with asyncio
 if __name__ == "__main__":
+    # Use uvloop's faster event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     asyncio.run(process_all_articles('cleaned_articleinfos.json', 'processed_papers.json'))
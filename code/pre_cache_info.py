@@ -5,11 +5,14 @@ import urllib.parse
 import json
 from contextlib import contextmanager
 from os.path import getsize
-from aiohttp_client_cache import CachedSession, SQLiteBackend
+from aiohttp_client_cache import CachedSession
 import aiofiles
+import aiohttp
+from utils import TunedSQLiteBackend
 
 CACHE_NAME = 'precache'
 JSON_FILE = 'urldict.json'  # JSON file containing the sciencealert URLs
+PRECACHE_CONCURRENCY = 20  # URLs fetched at once
 
 
 async def load_json_data():
@@ -39,18 +42,22 @@ async def get_sciencealert_urls(data):
 
 async def precache_page_links(urls):
     """Fetch and cache the content of the ScienceAlert URLs."""
-    async with CachedSession(cache=SQLiteBackend(CACHE_NAME)) as session:
-        # Create tasks to cache the URLs in parallel
-        tasks = [asyncio.create_task(cache_url(session, url)) for url in urls]
+    sem = asyncio.Semaphore(PRECACHE_CONCURRENCY)
+    # One pooled connector for the whole run, so connections are reused rather than piling up
+    connector = aiohttp.TCPConnector(limit=50, limit_per_host=10)
+    async with CachedSession(cache=TunedSQLiteBackend(CACHE_NAME), connector=connector) as session:
+        # Create tasks to cache the URLs in parallel, PRECACHE_CONCURRENCY at a time
+        tasks = [asyncio.create_task(cache_url(session, url, sem)) for url in urls]
         responses = await asyncio.gather(*tasks)
     return responses
 
 
-async def cache_url(session, url):
+async def cache_url(session, url, sem):
     """Cache the URL content using aiohttp's CachedSession."""
     try:
-        print(f'Fetching and caching URL: {url}')
-        response = await session.get(url)
+        async with sem:
+            print(f'Fetching and caching URL: {url}')
+            response = await session.get(url)
         return response
     except Exception as e:
         print(f'Error fetching {url}: {e}')
@@ -77,6 +84,13 @@ def measure_cache():
 
 
 if __name__ == '__main__':
+    # Use uvloop's faster event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     with measure_cache():
         # Load JSON data and extract URLs
         json_data = asyncio.run(load_json_data())
@@ -2,7 +2,22 @@ import json
 import httpx
 import asyncio
 import itertools
-from utils import get_working_proxies
+from aiolimiter import AsyncLimiter
+from utils import get_working_proxies, normalize_doi
+
+# Requests in flight at once, and OpenAlex's documented cap of 10 requests per second
+SEM = asyncio.Semaphore(10)
+OPENALEX_LIMITER = AsyncLimiter(10, 1)
+
+# Contact address sent with every request, which puts us in OpenAlex's polite pool
+MAILTO = "you@example.com"
+
+# Connection pool and timeouts for the shared HTTP/2 client
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+
+# DOIs looked up per OpenAlex filter query (the API accepts up to 100 OR'd values)
+DOI_BATCH_SIZE = 50
 
 
 async def get_paper_metadata(client, doi=None, url=None):
@@ -12,42 +27,115 @@ async def get_paper_metadata(client, doi=None, url=None):
 
     # Build the API URL
     if doi:
-        doi = doi.replace("https://doi.org/", "")
+        doi = doi.removeprefix("https://doi.org/")
         api_url = f"https://api.openalex.org/works/doi:{doi}"
     elif url:
         api_url = f"https://api.openalex.org/works/{url}"
 
     try:
-        response = await client.get(api_url)
+        async with SEM, OPENALEX_LIMITER:
+            response = await client.get(api_url)
         if response.status_code != 200:
             raise Exception(f"Error: Received status code {response.status_code} for {doi or url}.")
-        metadata = response.json()
+        return format_metadata(response.json())
+    except Exception as e:
+        return None
 
-        doi = metadata.get("doi", None)
-        if doi:
-            doi = doi[len("https://doi.org/"):]
-        title = metadata.get("display_name", "No Title Available")
 
+def format_metadata(metadata):
+    """Extract the fields we keep from an OpenAlex work."""
+    doi = metadata.get("doi", None)
+    if doi:
+        doi = doi.removeprefix("https://doi.org/")
+
+    # Walk the authorships and biblio once each
+    names = [authorship["author"]["display_name"] for authorship in metadata.get("authorships") or ()]
+    biblio = metadata.get("biblio") or {}
+
+    return {
+        "title": metadata.get("display_name", "No Title Available"),
+        "first_author": names[0] if names else "No Author",
+        "authors": ", ".join(names),
+        "year": metadata.get("publication_year", "Unknown Year"),
+        "doi": doi,
+        "doi_url": metadata.get("doi", "No DOI available"),
+        "journal_or_institution": metadata.get("host_venue", {}).get("display_name", "Unknown Institution"),
+        "pages": f"{biblio.get('first_page', '')}-{biblio.get('last_page', '')}",
+        "volume": biblio.get("volume", ""),
+        "number": biblio.get("issue", "")
+    }
+
+
+async def get_papers_by_doi(client, dois):
+    """Fetch up to DOI_BATCH_SIZE DOIs in one filter query, keyed by normalized DOI; None if the query failed."""
+    # httpx encodes the params, so '#', '&' and '+' inside a DOI can't break the query string
+    params = {"filter": "doi:" + "|".join(dois), "per-page": len(dois)}
+    try:
+        async with SEM, OPENALEX_LIMITER:
+            response = await client.get("https://api.openalex.org/works", params=params)
+        if response.status_code != 200:
+            raise Exception(f"Error: Received status code {response.status_code} for a batch of {len(dois)} DOIs.")
         return {
-            "title": metadata.get("display_name", "No Title Available"),
-            "first_author": metadata["authorships"][0]["author"]["display_name"] if metadata.get("authorships") else "No Author",
-            "authors": ", ".join([author["author"]["display_name"] for author in metadata.get("authorships", [])]),
-            "year": metadata.get("publication_year", "Unknown Year"),
-            "doi": doi,
-            "doi_url": metadata.get("doi", "No DOI available"),
-            "journal_or_institution": metadata.get("host_venue", {}).get("display_name", "Unknown Institution"),
-            "pages": f"{metadata['biblio'].get('first_page', '')}-{metadata['biblio'].get('last_page', '')}",
-            "volume": metadata["biblio"].get("volume", ""),
-            "number": metadata["biblio"].get("issue", "")
+            normalize_doi(metadata["doi"]): format_metadata(metadata)
+            for metadata in response.json()["results"]
+            if metadata.get("doi")
         }
     except Exception as e:
         return None
 
 
+async def prefetch_dois(client, article_batch, processed_papers):
+    """Look up every new DOI in a batch of articles with as few requests as possible, keyed by normalized DOI."""
+    dois = {}  # Normalized DOIs, deduplicated in order
+    for article in article_batch:
+        for paperlink in article['paperlinks']:
+            doi = paperlink.get('doi')
+            if doi and doi not in processed_papers:
+                dois[normalize_doi(doi)] = None
+
+    # '|' and ',' would split a DOI inside a filter query, so those are looked up singly
+    batchable = [doi for doi in dois if '|' not in doi and ',' not in doi]
+    singles = [doi for doi in dois if '|' in doi or ',' in doi]
+    chunks = [batchable[i:i + DOI_BATCH_SIZE] for i in range(0, len(batchable), DOI_BATCH_SIZE)]
+
+    papers = {}
+    for chunk, results in zip(chunks, await asyncio.gather(*(get_papers_by_doi(client, chunk) for chunk in chunks))):
+        if results is None:
+            # The batch query failed; fall back to one request per DOI
+            singles.extend(chunk)
+        else:
+            papers.update(results)
+    for doi, paper_data in zip(singles, await asyncio.gather(*(get_paper_metadata(client, doi=doi) for doi in singles))):
+        if paper_data:
+            papers[doi] = paper_data
+    return papers
+
+
+async def prefetch_urls(client, article_batch, processed_papers, papers_by_doi):
+    """Look up, all at once, the URL of every new link in a batch whose DOI is missing or found nothing."""
+    urls = {}  # Deduplicated in order
+    for article in article_batch:
+        for paperlink in article['paperlinks']:
+            doi = paperlink.get('doi')
+            paperlink_url = paperlink.get('paperlink')
+            if (doi if doi else paperlink_url) in processed_papers or not paperlink_url:
+                continue
+            if not doi or normalize_doi(doi) not in papers_by_doi:
+                urls[paperlink_url] = None
+
+    results = await asyncio.gather(*(get_paper_metadata(client, url=url) for url in urls))
+    return {url: paper_data for url, paper_data in zip(urls, results) if paper_data}
+
+
 async def process_article_batch(client, article_batch, processed_papers, no_match_articles, proxy_limit=50):
     """Process a batch of articles and fetch metadata for each paperlink."""
     success_count = 0  # Count the number of successful scrapes
 
+    # Fetch all of the batch's DOIs up front in filter queries instead of one request each
+    papers_by_doi = await prefetch_dois(client, article_batch, processed_papers)
+    # Then the URL fallbacks concurrently, leaving the loop below with no requests to wait on
+    papers_by_url = await prefetch_urls(client, article_batch, processed_papers, papers_by_doi)
+
     for article in article_batch:
         index = article['index']
         for paperlink in article['paperlinks']:
@@ -69,11 +157,14 @@ async def process_article_batch(client, article_batch, processed_papers, no_matc
                 # Try querying with DOI first
                 paper_data = None
                 if doi:
-                    paper_data = await get_paper_metadata(client, doi=doi)
+                    # Copy prefetched results, since the same paper may be stored under several keys
+                    paper_data = papers_by_doi.get(normalize_doi(doi))
+                    paper_data = dict(paper_data) if paper_data else None
 
                 # If DOI didn't work or wasn't available, try with URL
                 if not paper_data and paperlink_url:
-                    paper_data = await get_paper_metadata(client, url=paperlink_url)
+                    paper_data = papers_by_url.get(paperlink_url)
+                    paper_data = dict(paper_data) if paper_data else None
 
                 if paper_data:
                     # Successful retrieval
@@ -106,7 +197,13 @@ async def process_all_articles(articleinfos_path, output_path, proxy_limit=50):
 
     # Batch articles
     batch_size = 50  # Process 50 articles per batch
-    async with httpx.AsyncClient() as client:
+    # HTTP/2 multiplexes the concurrent OpenAlex requests over a single connection
+    async with httpx.AsyncClient(
+            http2=True,
+            limits=HTTP_LIMITS,
+            timeout=HTTP_TIMEOUT,
+            headers={"User-Agent": f"science_news/1.0 (mailto:{MAILTO})"},
+    ) as client:
         i = 0
         while i < len(articles):
             article_batch = articles[i:i + batch_size]
@@ -125,11 +222,11 @@ async def process_all_articles(articleinfos_path, output_path, proxy_limit=50):
     # Since 'processed_papers' is a dict, we can convert it to a list
     all_processed_papers = list(processed_papers.values())
     with open(output_path, 'w') as f:
-        json.dump(all_processed_papers, f, indent=4)
+        json.dump(all_processed_papers, f, separators=(",", ":"))
 
     # Save the no match articles to a separate file
     with open('no_match_articles.json', 'w') as f:
-        json.dump(no_match_articles, f, indent=4)
+        json.dump(no_match_articles, f, separators=(",", ":"))
 
     print(f"Paper metadata saved to {output_path}")
     print(f"No match articles saved to no_match_articles.json")
@@ -137,4 +234,11 @@ async def process_all_articles(articleinfos_path, output_path, proxy_limit=50):
 
 # Main function
 if __name__ == "__main__":
+    # Use uvloop's faster event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     asyncio.run(process_all_articles('articleinfos.json', 'processed_papers_three.json'))
@@ -1,85 +1,234 @@
-import json
+import orjson
+import time
+import sqlite3
 from collections import defaultdict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import aiohttp
+import aiofiles
+import ijson
 import asyncio
 from loguru import logger
 
 # Set up logging with loguru
 logger.add("file_cleaner.log", level="INFO", rotation="1 week", compression="zip")
 
-# Function to check if a URL redirects
-async def check_redirect(url, session):
-    logger.info(f"Checking URL: {url}")
+# Most redirect chains are a few hops; anything longer is treated as an error
+MAX_REDIRECTS = 10
+
+# URLs checked at once; the connection pool is sized to match
+REDIRECT_CONCURRENCY = 200
+
+# Time allowed for checking a single URL, and for connecting to its host
+REDIRECT_TIMEOUT = aiohttp.ClientTimeout(total=20, sock_connect=5)
+
+# HEAD responses that mean the server won't answer HEAD properly, so a ranged GET is sent instead
+HEAD_REJECTED_STATUSES = {400, 403, 405, 501}
+
+# Hosts that have rejected HEAD; later URLs on them skip straight to the ranged GET
+_get_only_hosts = set()
+
+# Session shared by every check_all_urls call on one event loop; created by get_session()
+_session: aiohttp.ClientSession | None = None
+_session_loop: asyncio.AbstractEventLoop | None = None
+
+# Articles read ahead of the workers; bounds memory however large the input is
+ARTICLE_QUEUE_SIZE = 1000
+
+# Resolved redirects (and non-redirects) are kept here between runs
+REDIRECT_CACHE_PATH = "redirect_cache.sqlite"
+
+# Cached entries older than this are checked again; "no redirect" entries go stale sooner
+REDIRECT_CACHE_TTL = 30 * 24 * 60 * 60
+NO_REDIRECT_CACHE_TTL = 7 * 24 * 60 * 60
+
+# The cache is committed after this many new entries, so an interrupted run keeps what it resolved
+REDIRECT_CACHE_COMMIT_EVERY = 500
+
+# Query parameters that only track the click and never change where a URL leads
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "_ga"}
+
+# Function to normalize a URL so trivially different spellings share one cache entry
+def normalize_url(url):
+    parts = urlsplit(url)
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                       if key not in TRACKING_PARAMS and not key.startswith("utm_")])
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), query, parts.fragment))
+
+# Function to open the redirect cache; one connection serves every lookup in a run
+def open_redirect_cache(path=REDIRECT_CACHE_PATH):
+    cache = sqlite3.connect(path)
+    cache.execute("PRAGMA journal_mode=WAL")
+    cache.execute("PRAGMA synchronous=NORMAL")
+    cache.execute("CREATE TABLE IF NOT EXISTS redirects "
+                  "(url TEXT PRIMARY KEY, final_url TEXT, is_redirect INT, ts INT)")
+    return cache
+
+# Function to get the shared session, creating it on first use
+async def get_session():
+    """Return the module's ClientSession, so repeated clean_file calls reuse its connections and DNS cache."""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    # A session left over from an earlier asyncio.run() is bound to a dead loop and can't be used
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(limit=REDIRECT_CONCURRENCY, limit_per_host=20, ttl_dns_cache=300,
+                                         keepalive_timeout=30, enable_cleanup_closed=True)
+        _session = aiohttp.ClientSession(connector=connector, timeout=REDIRECT_TIMEOUT)
+        _session_loop = loop
+    return _session
+
+# Function to close the shared session; call it before the event loop that created it shuts down
+async def close_session():
+    global _session, _session_loop
+    if _session is not None:
+        await _session.close()
+        _session = None
+        _session_loop = None
+
+# Function to check if a URL redirects, following the whole chain to its final URL
+async def check_redirect(url, session, cache=None):
+    # Arguments are formatted by loguru only if the message is actually logged
+    logger.info("Checking URL: {}", url)
+    if cache is not None:
+        key = normalize_url(url)
+        row = cache.execute("SELECT final_url, is_redirect, ts FROM redirects WHERE url = ?", (key,)).fetchone()
+        if row and time.time() - row[2] < (REDIRECT_CACHE_TTL if row[1] else NO_REDIRECT_CACHE_TTL):
+            final_url, is_redirect, _ = row
+            logger.info("Cached: {} -> {}", url, final_url if is_redirect else "no redirect")
+            return (True, url, final_url) if is_redirect else (False, url, url)
+    host = urlsplit(url).netloc.lower()
     try:
-        async with session.head(url, allow_redirects=False) as response:
-            if 300 <= response.status < 400:  # Status codes for redirects
-                final_url = str(response.headers.get('Location', url))
-                logger.info(f"Redirect found: {url} -> {final_url}")
-                return True, url, final_url  # Return original and final redirect location
-            logger.info(f"No redirect: {url}")
-            return False, url, url  # No redirect, return the original URL
+        if host not in _get_only_hosts:
+            # HEAD fetches the headers only; the final URL is all we need
+            async with session.head(url, allow_redirects=True, max_redirects=MAX_REDIRECTS) as response:
+                status = response.status
+                history = response.history
+                final_url = str(response.url)
+            if status in HEAD_REJECTED_STATUSES:
+                _get_only_hosts.add(host)
+        if host in _get_only_hosts:
+            # The server rejects HEAD; ask for a single byte with GET and drop the body unread
+            async with session.get(url, allow_redirects=True, max_redirects=MAX_REDIRECTS,
+                                   headers={"Range": "bytes=0-0"}) as response:
+                response.release()
+                history = response.history
+                final_url = str(response.url)
     except Exception as e:
-        logger.error(f"Error checking URL {url}: {e}")
-        return False, url, url  # On error, assume no redirect
+        logger.error("Error checking URL {}: {}", url, e)
+        return False, url, url  # On error, assume no redirect; not cached so the next run retries it
+
+    is_redirect = bool(history)  # Status codes for redirects were followed to reach final_url
+    if cache is not None:
+        # Non-redirects are stored too, so they aren't checked again either
+        cache.execute("INSERT OR REPLACE INTO redirects VALUES (?, ?, ?, ?)",
+                      (key, final_url, int(is_redirect), int(time.time())))
+        if cache.total_changes % REDIRECT_CACHE_COMMIT_EVERY == 0:
+            cache.commit()
+    if is_redirect:
+        logger.info("Redirect found: {} -> {}", url, final_url)
+        return True, url, final_url  # Return original and final redirect location
+    logger.info("No redirect: {}", url)
+    return False, url, url  # No redirect, return the original URL
 
-# Function to process the URLs in the JSON data
-async def check_all_urls(data):
+# Function to check the URLs of a stream of articles and write each updated article as a JSON line
+async def check_all_urls(articles, outfile, concurrency=REDIRECT_CONCURRENCY):
+    """
+    Check the URLs of every article from the async iterable `articles`, writing each article to
+    `outfile` as a JSON line as soon as its URLs are resolved. Lines are written in completion order,
+    so each article carries its input position as "article_id", and an article that fails is written
+    with an "error" field. Only a bounded queue of articles is held in memory.
+    """
     redirect_counter = defaultdict(list)
     non_redirect_counter = defaultdict(list)
 
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        task_index_map = {}
-
-        # Iterate over each article in the data
-        for article_id, article_data in enumerate(data):
-            # Check ScienceAlert links
-            if "url" in article_data:
-                sciencealert_link = article_data["url"]
-                task = check_redirect(sciencealert_link, session)
-                task_index_map[task] = (article_id, "url", sciencealert_link)
-                tasks.append(task)
-
-            # Process DOIs and URLs in the article
-            paperlinks = article_data.get("paperlinks", [])
-            for i, link in enumerate(paperlinks):
-                paperlink = link.get("paperlink", None)
-                if paperlink:
-                    task = check_redirect(paperlink, session)
-                    task_index_map[task] = (article_id, f"paperlinks[{i}]", paperlink)
-                    tasks.append(task)
-
-        # Gather all tasks
-        results = await asyncio.gather(*tasks)
-
-        # Separate redirects from non-redirects and update the data
-        for result, task in zip(results, tasks):
-            is_redirect, original_url, final_url = result
-            article_id, key, url_checked = task_index_map[task]
+    # Cap the checks in flight so a large file can't exhaust sockets or oversubscribe the pool
+    sem = asyncio.Semaphore(concurrency)
 
+    cache = open_redirect_cache()
+    session = await get_session()
+
+    async def bounded_check(url):
+        async with sem:
+            return await check_redirect(url, session, cache)
+
+    # One shared check per distinct URL, so a link cited by many articles is checked only once
+    url_checks = {}
+    queue = asyncio.Queue(maxsize=ARTICLE_QUEUE_SIZE)
+
+    async def update_article(article_id, article_data):
+        # (key, url) for each URL in the article; the key says where to write the final URL back
+        locations = []
+        # Check ScienceAlert links
+        if "url" in article_data:
+            locations.append((("url", None), article_data["url"]))
+
+        # Process DOIs and URLs in the article
+        paperlinks = article_data.get("paperlinks", [])
+        for i, link in enumerate(paperlinks):
+            paperlink = link.get("paperlink", None)
+            if paperlink:
+                locations.append((("paperlink", i), paperlink))
+
+        for _, url in locations:
+            if url not in url_checks:
+                url_checks[url] = asyncio.ensure_future(bounded_check(url))
+        results = await asyncio.gather(*(url_checks[url] for _, url in locations))
+
+        # Separate redirects from non-redirects and update the article
+        for (is_redirect, original_url, final_url), (key, _) in zip(results, locations):
             # Update the structure for ScienceAlert or paperlinks
-            if key == "url":
-                # Overwrite the original URL with the redirected URL (if found)
-                data[article_id]["url"] = final_url
-                if is_redirect:
-                    redirect_counter[final_url].append((article_id, original_url))
-                else:
-                    non_redirect_counter[original_url].append((article_id, original_url))
-            elif key.startswith("paperlinks"):
-                index = int(key.split("[")[1].strip("]"))  # Extract index
-                data[article_id]["paperlinks"][index]["paperlink"] = final_url
-                if is_redirect:
-                    redirect_counter[final_url].append((article_id, original_url))
-                else:
-                    non_redirect_counter[original_url].append((article_id, original_url))
-
-    return redirect_counter, non_redirect_counter, data
+            match key:
+                case ("url", _):
+                    # Overwrite the original URL with the redirected URL (if found)
+                    article_data["url"] = final_url
+                case ("paperlink", index):
+                    article_data["paperlinks"][index]["paperlink"] = final_url
+            if is_redirect:
+                redirect_counter[final_url].append((article_id, original_url))
+            else:
+                non_redirect_counter[original_url].append((article_id, original_url))
+
+        # Extract DOIs from DOI URLs
+        if 'doi_urls' in article_data:
+            # Extract and remove duplicates for DOI URLs
+            article_data['dois'] = clean_doi_urls(article_data['doi_urls'])
+            article_data['doi_urls'] = clean_doi_urls(article_data['doi_urls'], prefix=None)
+
+    async def worker():
+        while True:
+            article_id, article_data = await queue.get()
+            try:
+                await update_article(article_id, article_data)
+                await outfile.write(orjson.dumps(article_data) + b"\n")
+            except Exception as e:
+                logger.error("Error processing article {}: {}", article_id, e)
+                # Still write the article, marked, so the output keeps one line per input article
+                article_data["error"] = str(e) or type(e).__name__
+                await outfile.write(orjson.dumps(article_data) + b"\n")
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        article_id = 0
+        async for article_data in articles:
+            # Lines are written in completion order; article_id is the article's position in the input
+            article_data["article_id"] = article_id
+            await queue.put((article_id, article_data))
+            article_id += 1
+        await queue.join()
+    finally:
+        for worker_task in workers:
+            worker_task.cancel()
+        # Keep whatever was resolved, even if the run failed part way
+        cache.commit()
+        cache.close()
+
+    return redirect_counter, non_redirect_counter
 
 # Function to remove duplicate DOIs from a list
 def get_doi_from_url(url, prefix="https://doi.org/"):
     """Remove 'https://doi.org/' prefix from DOI URLs."""
-    prefix = prefix
-    if url.startswith(prefix):
+    if prefix and url.startswith(prefix):
         return url[len(prefix):]
     return url
 
@@ -95,32 +244,18 @@ async def extract_dois_from_urls(doi_urls):
     return [url.split('/')[-1] for url in doi_urls]
 
 # Function to clean the file by extracting DOIs and checking URLs
-async def clean_file(input_filename, output_filename):
-    """Clean the input file by extracting DOIs and checking URLs."""
+async def clean_file(input_filename, output_filename, keep_session=False):
+    """
+    Clean the input file by extracting DOIs and checking URLs. The shared session is closed afterwards
+    unless keep_session is set, for callers cleaning several files that will call close_session() themselves.
+    """
     logger.info("Starting the cleaning process...")
 
     try:
-        # Load the JSON data
-        with open(input_filename, 'r') as file:
-            data = json.load(file)
-    except Exception as e:
-        logger.error(f"Error loading input file {input_filename}: {e}")
-        return
-
-    try:
-        # Check redirects and update URLs in the data
-        redirect_counter, non_redirect_counter, updated_data = await check_all_urls(data)
-
-        # Extract DOIs from DOI URLs and update the data
-        for article in updated_data:
-            if 'doi_urls' in article:
-                # Extract and remove duplicates for DOI URLs
-                article['dois'] = clean_doi_urls(article['doi_urls'])
-                article['doi_urls'] = clean_doi_urls(article['doi_urls'], prefix=None)
-
-        # Save the cleaned data to a new file (overwrite old URLs with final redirected URLs)
-        with open(output_filename, 'w') as file:
-            json.dump(updated_data, file, indent=4)
+        # Stream the articles from the input and write each one out as a JSON line once its URLs are checked
+        async with aiofiles.open(input_filename, 'rb') as infile, aiofiles.open(output_filename, 'wb') as outfile:
+            articles = ijson.items(infile, 'item', use_float=True)
+            redirect_counter, non_redirect_counter = await check_all_urls(articles, outfile)
 
         logger.info("Cleaning process completed successfully.")
 
@@ -137,6 +272,9 @@ async def clean_file(input_filename, output_filename):
 
     except Exception as e:
         logger.error(f"Error during the cleaning process: {e}")
+    finally:
+        if not keep_session:
+            await close_session()
 
 # Main function to run the cleaning process
 
@@ -1,4 +1,4 @@
-import json
+import orjson
 
 # Function to reformat the JSON structure
 def reformat_json(data):
@@ -13,14 +13,15 @@ def reformat_json(data):
     return reformatted_data
 
 # Load the data from the JSON file
-with open('JSON/urldict.json', 'r') as infile:
-    data = json.load(infile)
+with open('JSON/urldict.json', 'rb') as infile:
+    data = orjson.loads(infile.read())
 
 # Reformat the data
 reformatted_data = reformat_json(data)
 
 # Save the reformatted data to a new JSON file
-with open('JSON/reformatted_urldict.json', 'w') as outfile:
-    json.dump(reformatted_data, outfile, indent=4)
+# orjson only indents by two spaces; the file stays readable
+with open('JSON/reformatted_urldict.json', 'wb') as outfile:
+    outfile.write(orjson.dumps(reformatted_data, option=orjson.OPT_INDENT_2))
 
 print("Reformatted JSON has been saved as 'reformatted_urldict.json'.")
@@ -3,6 +3,8 @@
 import os
 import json
 import asyncio
+import msgspec
+from functools import lru_cache
 import aiohttp
 from bs4 import BeautifulSoup
 from loguru import logger
@@ -10,11 +12,45 @@ from loguru import logger
 from urllib.parse import urlparse, parse_qs
 from w3lib.url import url_query_cleaner
 from url_normalize import url_normalize
-from base_classes import BaseScraper, BaseCleaner
+from base_scraper import BaseScraper
+from base_classes import BaseCleaner
 from data_models import Article, ArticleCollection
 from open_alex_scraper import OpenAlexScraper  # Ensure this is available or adjust accordingly
 
 
+@lru_cache(maxsize=131072)
+def _clean_doi(doi_url):
+    """Extract the DOI from a DOI URL; cached because the same DOIs recur across articles."""
+    # Extract the path from the DOI URL
+    parsed_url = urlparse(doi_url)
+    doi = parsed_url.path
+    doi = doi.lstrip('/')
+    parts_to_remove = [
+        'doi/full/', 'doi/pdf/', 'pdf/full/', 'doi:', 'doi.org/', 'doi/', 'abstract/',
+        'full/', 'pdf/', 'epdf/', 'abs/', '/doi', '/abstract', '/full', '/pdf', '/epdf', '/abs', '/html', 'html/'
+    ]
+    for part in parts_to_remove:
+        doi = doi.replace(part, '')
+    doi = doi.split('?')[0]  # Remove query parameters
+    return doi
+
+
+@lru_cache(maxsize=131072)
+def _canonical_url(u):
+    """Normalize a URL; cached because the same links recur across articles."""
+    parsed_url = urlparse(u)
+    query_params = parse_qs(parsed_url.query)
+    if 'u' in query_params:
+        embedded_url = query_params['u'][0]
+        u = embedded_url
+    u = url_normalize(u)
+    u = url_query_cleaner(u, parameterlist=['utm_source', 'utm_medium', 'utm_campaign', 'gclid', 'fbclid'],
+                          remove=True)
+    if u.endswith("/"):
+        u = u[:-1]
+    return u
+
+
 class ScienceAlertScraper(BaseScraper):
     def __init__(
         self,
@@ -45,7 +81,7 @@ class ScienceAlertScraper(BaseScraper):
             logger.info(f"Loaded data from {self.json_input_file}")
         except FileNotFoundError:
             logger.error(f"Error: {self.json_input_file} does not exist.")
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, msgspec.DecodeError):
             logger.error(f"Error: Failed to decode JSON from {self.json_input_file}.")
 
     async def load_existing_output(self):
@@ -318,31 +354,8 @@ class ScienceAlertScraper(BaseScraper):
 
     def clean_doi(self, doi_url):
         """Clean the DOI by extracting and cleaning the path from the DOI URL."""
-        # Extract the path from the DOI URL
-        parsed_url = urlparse(doi_url)
-        doi = parsed_url.path
-        doi = doi.lstrip('/')
-        parts_to_remove = [
-            'doi/full/', 'doi/pdf/', 'pdf/full/', 'doi:', 'doi.org/', 'doi/', 'abstract/',
-            'full/', 'pdf/', 'epdf/', 'abs/', '/doi', '/abstract', '/full', '/pdf', '/epdf', '/abs', '/html', 'html/'
-        ]
-        for part in parts_to_remove:
-            doi = doi.replace(part, '')
-        doi = doi.split('?')[0]  # Remove query parameters
-        return doi
-
-
+        return _clean_doi(doi_url)
 
     def canonical_url(self, u):
         """Normalize and clean the URL, following 'u=' embedded URLs if present."""
-        parsed_url = urlparse(u)
-        query_params = parse_qs(parsed_url.query)
-        if 'u' in query_params:
-            embedded_url = query_params['u'][0]
-            u = embedded_url
-        u = url_normalize(u)
-        u = url_query_cleaner(u, parameterlist=['utm_source', 'utm_medium', 'utm_campaign', 'gclid', 'fbclid'],
-                              remove=True)
-        if u.endswith("/"):
-            u = u[:-1]
-        return u
+        return _canonical_url(u)
@@ -2,6 +2,7 @@
 
 
 import asyncio
+import functools
 import aiohttp
 from collections import defaultdict
 from urllib.parse import urlparse, parse_qs
@@ -136,15 +137,20 @@ class URLCleaner(BaseCleaner):
         if not u:
             logger.warning("Received None or empty string in canonical_url")
             return u  # Return None or empty string as appropriate
-
-        parsed_url = urlparse(u)
-        query_params = parse_qs(parsed_url.query)
-        if 'u' in query_params:
-            embedded_url = query_params['u'][0]
-            u = embedded_url
-        u = url_normalize(u)
-        u = url_query_cleaner(u, parameterlist=['utm_source', 'utm_medium', 'utm_campaign', 'gclid', 'fbclid'],
-                              remove=True)
-        if u.endswith("/"):
-            u = u[:-1]
-        return u
+        return _canonical_url(u)
+
+
+@functools.lru_cache(maxsize=131072)
+def _canonical_url(u):
+    # Cached, since the same links recur across many articles
+    parsed_url = urlparse(u)
+    query_params = parse_qs(parsed_url.query)
+    if 'u' in query_params:
+        embedded_url = query_params['u'][0]
+        u = embedded_url
+    u = url_normalize(u)
+    u = url_query_cleaner(u, parameterlist=['utm_source', 'utm_medium', 'utm_campaign', 'gclid', 'fbclid'],
+                          remove=True)
+    if u.endswith("/"):
+        u = u[:-1]
+    return u
@@ -2,6 +2,7 @@ import os
 import sys
 import pathlib
 from concurrent.futures import as_completed
+from functools import lru_cache
 from random import choice
 
 import requests
@@ -12,6 +13,7 @@ import aiohttp
 import aiofiles
 import asyncio
 from urllib.parse import urlparse, urlunparse
+from aiohttp_client_cache import SQLiteBackend
 
 
 # Function to get working proxies
@@ -57,3 +59,47 @@ def get_working_proxies(refresh: bool = False):
 
     os.system("cls")
     return [None] + working_proxies
+
+
+DOI_PREFIXES = ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "http://dx.doi.org/", "doi:")
+
+
+# Normalize a DOI to its bare lowercase form, so the same DOI always maps to the same cache key
+@lru_cache(maxsize=131072)
+def normalize_doi(doi: str) -> str:
+    doi = doi.strip().lower()
+    for prefix in DOI_PREFIXES:
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+            break
+    doi = doi.rstrip('.,;')
+    # Drop a closing parenthesis picked up from surrounding text, but not one that belongs to the DOI
+    if doi.endswith(')') and doi.count(')') > doi.count('('):
+        doi = doi[:-1]
+    return doi
+
+
+# Connection settings for the response cache: WAL lets reads continue during writes, and NORMAL sync
+# only fsyncs at checkpoints, which is still safe against corruption in WAL mode
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+
+# An SQLiteBackend that applies SQLITE_PRAGMAS when its connection is first opened
+class TunedSQLiteBackend(SQLiteBackend):
+    def __init__(self, cache_name: str = 'aiohttp-cache', **kwargs):
+        super().__init__(cache_name, **kwargs)
+        responses = self.responses
+        init_db = responses._init_db
+
+        # The redirects table shares this connection, so tuning it here covers both tables
+        async def _init_db():
+            for pragma in SQLITE_PRAGMAS:
+                await responses._connection.execute(pragma)
+            await init_db()
+
+        responses._init_db = _init_db